@@ -0,0 +1,139 @@
+"""
+Maintenance of the PasswordAccess table behind Password.objects.visible_to
+and password permission checks.
+
+Every change to created_by, organization membership, organization
+passwords or shares refreshes the (user, password) pairs it can affect:
+the masks are recomputed from the source relations for that scope and
+the stored rows are brought in line. rebuild() does the same for every
+user and is what rebuild_password_access runs.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from .models import Organization, Password, PasswordAccess, Share, User
+
+_state = threading.local()
+
+
+def scoped(queryset, user_field, password_field, user_ids, password_ids, **filters):
+    # One filter() call, so multi-valued lookups share a single join
+    if user_ids is not None:
+        filters[user_field + '__in'] = user_ids
+    if password_ids is not None:
+        filters[password_field + '__in'] = password_ids
+    return queryset.filter(**filters)
+
+
+def compute(user_ids=None, password_ids=None):
+    """
+    {(user_id, password_id): mask} derived from the source relations for
+    the pairs within the scope, None meaning unrestricted.
+    """
+    masks = defaultdict(int)
+    owned = scoped(Password.objects, 'created_by', 'id', user_ids, password_ids, created_by__isnull=False)
+    for user_id, password_id in owned.values_list('created_by_id', 'id'):
+        masks[user_id, password_id] |= PasswordAccess.OWNER
+
+    in_organization = scoped(Organization.passwords.through.objects, 'organization__user', 'password',
+                             user_ids, password_ids, organization__user__isnull=False)
+    for user_id, password_id in in_organization.values_list('organization__user', 'password_id').distinct():
+        masks[user_id, password_id] |= PasswordAccess.ORGANIZATION
+
+    shared = scoped(Share.objects, 'user', 'password', user_ids, password_ids)
+    for user_id, password_id, codename in shared.values_list('user_id', 'password_id', 'permissions__codename'):
+        masks[user_id, password_id] |= PasswordAccess.SHARED | PasswordAccess.PERMISSION_BITS.get(codename, 0)
+    return masks
+
+
+def refresh(user_ids=None, password_ids=None, dry_run=False):
+    """
+    Bring the stored rows within the scope in line with compute().
+    Returns the number of rows (inserted, updated, deleted).
+    """
+    scope = getattr(_state, 'deferred', None)
+    if scope is not None:
+        scope.add(user_ids, password_ids)
+        return 0, 0, 0
+    if user_ids is not None and not user_ids or password_ids is not None and not password_ids:
+        return 0, 0, 0
+
+    with transaction.atomic():
+        masks = compute(user_ids, password_ids)
+        stored = scoped(PasswordAccess.objects, 'user', 'password', user_ids, password_ids)
+        updated, deleted = [], []
+        for row in stored.only('id', 'user_id', 'password_id', 'mask'):
+            mask = masks.pop((row.user_id, row.password_id), 0)
+            if not mask:
+                deleted.append(row.id)
+            elif mask != row.mask:
+                row.mask = mask
+                updated.append(row)
+        inserted = [PasswordAccess(user_id=user_id, password_id=password_id, mask=mask)
+                    for (user_id, password_id), mask in masks.items()]
+        if not dry_run:
+            PasswordAccess.objects.filter(id__in=deleted).delete()
+            PasswordAccess.objects.bulk_update(updated, ['mask'], batch_size=1000)
+            # A concurrent refresh of the same pair already wrote the same mask
+            PasswordAccess.objects.bulk_create(inserted, batch_size=1000, ignore_conflicts=True)
+    return len(inserted), len(updated), len(deleted)
+
+
+class Scope:
+    """
+    Union of the scopes refreshed inside deferred(), None meaning everyone.
+    """
+    def __init__(self):
+        self.user_ids, self.password_ids, self.touched = set(), set(), False
+
+    def add(self, user_ids, password_ids):
+        self.touched = True
+        self.user_ids = None if user_ids is None or self.user_ids is None else self.user_ids | set(user_ids)
+        self.password_ids = (None if password_ids is None or self.password_ids is None
+                             else self.password_ids | set(password_ids))
+
+
+@contextmanager
+def deferred():
+    """
+    Collect the refreshes of a bulk change and run them as one when the
+    block exits, instead of once per row.
+    """
+    if getattr(_state, 'deferred', None) is not None:
+        yield
+        return
+    _state.deferred = scope = Scope()
+    try:
+        yield
+    finally:
+        _state.deferred = None
+    if scope.touched:
+        refresh(scope.user_ids, scope.password_ids)
+
+
+def organization_scope(organization_ids):
+    """
+    (member ids, password ids) of the organizations.
+    """
+    user_ids = set(User.organizations.through.objects.filter(organization_id__in=organization_ids)
+                   .values_list('user_id', flat=True))
+    password_ids = set(Organization.passwords.through.objects.filter(organization_id__in=organization_ids)
+                       .values_list('password_id', flat=True))
+    return user_ids, password_ids
+
+
+def rebuild(batch_size=1000, dry_run=False):
+    """
+    Refresh every user in batches. Returns the total (inserted, updated,
+    deleted), all zero when the table matched the source relations.
+    """
+    totals = [0, 0, 0]
+    # Rows whose user no longer exists are removed by the foreign key cascade
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(user_ids), batch_size):
+        counts = refresh(user_ids[start:start + batch_size], dry_run=dry_run)
+        totals = [total + count for total, count in zip(totals, counts)]
+    return tuple(totals)
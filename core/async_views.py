@@ -0,0 +1,130 @@
+"""
+Native async versions of the read-heavy password endpoints, meant to be
+served by password_mngmt.asgi. ORM access uses Django's async API and
+decryption runs on a bounded thread pool, so a slow client only holds a
+coroutine, not a worker thread.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import audit
+from .models import Password
+from .serializers import PasswordSerializer
+from .util import decrypt_many
+
+
+@lru_cache(maxsize=None)
+def get_crypto_executor():
+    return ThreadPoolExecutor(max_workers=settings.ASYNC_CRYPTO_WORKERS, thread_name_prefix='async-crypto')
+
+
+async def decrypt_passwords(passwords):
+    """
+    Decrypt on the bounded executor, sequentially inside it so the pool is
+    never waited on from one of its own threads.
+    """
+    cipher_texts = [password.cipher_text for password in passwords]
+    loop = asyncio.get_running_loop()
+    plaintexts = await loop.run_in_executor(get_crypto_executor(), decrypt_many, cipher_texts, 1)
+    return dict(zip(cipher_texts, plaintexts))
+
+
+def require_GET(view):
+    """
+    django.views.decorators.http.require_GET for coroutine views, which it
+    only supports from Django 5.0. Read only views need no CSRF check, so
+    unsafe methods get 405 rather than a CSRF failure.
+    """
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+    inner.csrf_exempt = True
+    return inner
+
+
+async def authenticate(request):
+    """
+    Wrap the request for DRF and run the configured authenticators, which
+    may hit the database, off the event loop.
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = await sync_to_async(lambda: drf_request.user)()
+    except exceptions.APIException as e:
+        return drf_request, JsonResponse({'detail': e.detail}, status=e.status_code)
+    if not user or not user.is_authenticated:
+        return drf_request, JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                                         status=status.HTTP_401_UNAUTHORIZED)
+    return drf_request, None
+
+
+async def serialize(drf_request, passwords, many):
+    serializer = PasswordSerializer(passwords, many=many, context={'request': drf_request})
+    child = serializer.child if many else serializer
+    if 'decrypt_password' in child.fields:
+        child._plaintexts.update(await decrypt_passwords(passwords if many else [passwords]))
+    return serializer.data
+
+
+@require_GET
+async def password_list(request):
+    """ Keyset paginated passwords: ?after=<id>&page_size= """
+    drf_request, error = await authenticate(request)
+    if error:
+        return error
+    try:
+        after = int(request.GET.get('after', 0))
+        page_size = min(int(request.GET.get('page_size', 50)), 500)
+    except ValueError:
+        return JsonResponse({'message':'after and page_size must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+    queryset = Password.objects.visible_to(drf_request.user).with_status().filter(id__gt=after).order_by('id')
+    passwords = [password async for password in queryset[:page_size + 1]]
+    has_next = len(passwords) > page_size
+    passwords = passwords[:page_size]
+
+    next_url = None
+    if has_next:
+        query = request.GET.copy()
+        query['after'] = passwords[-1].id
+        next_url = request.build_absolute_uri('?' + query.urlencode())
+    data = await serialize(drf_request, passwords, many=True)
+    return JsonResponse({'next': next_url, 'results': data})
+
+
+@require_GET
+async def password_detail(request, password_id):
+    drf_request, error = await authenticate(request)
+    if error:
+        return error
+    password = await Password.objects.visible_to(drf_request.user).with_status().filter(id=password_id).afirst()
+    if password is None:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse(await serialize(drf_request, password, many=False))
+
+
+@require_GET
+async def shared_password_detail(request, password_id):
+    drf_request, error = await authenticate(request)
+    if error:
+        return error
+    # A missing password is a 404 before any permission check, like SharedPasswordView
+    password = await Password.objects.with_status().filter(id=password_id).afirst()
+    if password is None:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    permissions = await sync_to_async(drf_request.user.password_permissions)(password_id)
+    if 'view_password' not in permissions:
+        return JsonResponse({'detail': 'You do not have permission to perform this action.'},
+                            status=status.HTTP_403_FORBIDDEN)
+    audit.record('shared_access', drf_request.user, password_id=password_id, detail=request.method, request=request)
+    return JsonResponse(await serialize(drf_request, password, many=False))
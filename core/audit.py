@@ -0,0 +1,162 @@
+"""
+Buffered audit trail of secret reveals, shared password access and share
+changes.
+
+record() only appends to an in-process buffer. A background thread,
+started by the WSGI and ASGI entry points, writes the buffer with one
+bulk_create when it holds AUDIT_BATCH_SIZE events or every
+AUDIT_FLUSH_INTERVAL seconds, and once more at shutdown. Without the
+thread (tests, management commands) a full batch is written inline. When
+writes fall behind and AUDIT_MAX_BUFFER events are waiting, new events
+are dropped and counted instead of slowing requests down.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .instrumentation import registry
+from .models import AuditEvent
+
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def client_address(request):
+    return request.META.get('REMOTE_ADDR') if request is not None else None
+
+
+class AuditBuffer:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._events = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.started = False
+        self.recorded = self.flushed = self.dropped = self.failed = self.flushes = 0
+        self.high_water = 0
+
+    def record(self, action, user_id, password_id=None, share_id=None, target_user_id=None, detail='',
+               request=None):
+        event = AuditEvent(action=action, user_id=user_id, password_id=password_id, share_id=share_id,
+                           target_user_id=target_user_id, detail=detail[:255], remote_addr=client_address(request),
+                           created_at=timezone.now())
+        with self._lock:
+            if len(self._events) >= settings.AUDIT_MAX_BUFFER:
+                self.dropped += 1
+                return
+            self._events.append(event)
+            self.recorded += 1
+            self.high_water = max(self.high_water, len(self._events))
+            full = len(self._events) >= settings.AUDIT_BATCH_SIZE
+        if self.started:
+            self._ensure_thread()
+            if full:
+                self._wake.set()
+        elif full and not in_event_loop():
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything buffered so far. Returns the number of events written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            start = time.perf_counter()
+            try:
+                AuditEvent.objects.bulk_create(events, batch_size=settings.AUDIT_BATCH_SIZE)
+            except Exception:
+                logging.getLogger('error_logger').error(traceback.format_exc())
+                with self._lock:
+                    self.failed += len(events)
+                return 0
+            registry.observe('audit', {'flush': (time.perf_counter() - start) * 1000})
+            with self._lock:
+                self.flushed += len(events)
+                self.flushes += 1
+            return len(events)
+
+    def start(self):
+        """
+        Flush from a background thread from now on, and at exit.
+        """
+        if not self.started:
+            self.started = True
+            atexit.register(self.stop)
+        self._ensure_thread()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=settings.AUDIT_FLUSH_INTERVAL + 5)
+        self._thread = None
+        self.started = False
+        self._stopping.clear()
+        self.flush()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, a pre-forking server starts one per worker
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(settings.AUDIT_FLUSH_INTERVAL)
+            self._wake.clear()
+            close_old_connections()
+            self.flush()
+        close_old_connections()
+
+    def clear(self):
+        with self._lock:
+            self._events = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buffered': len(self._events),
+                'high_water': self.high_water,
+                'recorded': self.recorded,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'background': self.started,
+            }
+
+
+buffer = AuditBuffer()
+
+
+def record(action, user, password_id=None, share_id=None, target_user_id=None, detail='', request=None):
+    buffer.record(action, getattr(user, 'pk', None), password_id, share_id, target_user_id, detail, request)
+
+
+def start():
+    buffer.start()
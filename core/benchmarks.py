@@ -0,0 +1,253 @@
+"""
+Synthetic data and request driver for the benchmark_api command.
+"""
+import json
+import math
+import time
+from datetime import timedelta
+from itertools import count
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Permission
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import access, audit
+from .models import User, Organization, Password, Share, AuditEvent
+from .util import encrypt_many, fingerprint, password_strength
+
+SCALES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+BENCHMARK_PASSWORD = 'Benchmark#2022'
+
+
+def bulk_insert(model, objects, batch_size=2000):
+    with transaction.atomic():
+        model.objects.bulk_create(objects, batch_size=batch_size)
+
+
+def seed(passwords, batch_size=2000):
+    """
+    Create users, organizations, passwords and shares for a vault of the
+    given size. Every user shares one hashed password so seeding stays fast.
+    """
+    user_count = max(10, passwords // 10)
+    organization_count = max(2, user_count // 10)
+    share_count = passwords // 4
+    now = timezone.now()
+    hashed = make_password(BENCHMARK_PASSWORD)
+
+    bulk_insert(User, [
+        User(email='bench%s@example.com' % i, first_name='Bench', last_name=str(i), password=hashed)
+        for i in range(user_count)
+    ], batch_size)
+    bulk_insert(Organization, [
+        Organization(name='Org %s' % i, organizationId='bench%s' % i)
+        for i in range(organization_count)
+    ], batch_size)
+    user_ids = list(User.objects.filter(email__startswith='bench').order_by('id').values_list('id', flat=True))
+    organization_ids = list(Organization.objects.filter(organizationId__startswith='bench')
+                            .order_by('id').values_list('id', flat=True))
+    bulk_insert(User.organizations.through, [
+        User.organizations.through(user_id=user_id, organization_id=organization_ids[i % organization_count])
+        for i, user_id in enumerate(user_ids)
+    ], batch_size)
+
+    plaintext = 'Secret#0rd'
+    for start in range(0, passwords, batch_size):
+        stop = min(start + batch_size, passwords)
+        cipher_texts = encrypt_many([plaintext] * (stop - start))
+        bulk_insert(Password, [
+            Password(title='bench-%s' % i, cipher_text=cipher_texts[i - start], strength=password_strength(plaintext),
+                     fingerprint=fingerprint(plaintext), duration_in_days=30, expired_at=now + timedelta(days=i % 60 - 10),
+                     created_by_id=user_ids[i % user_count])
+            for i in range(start, stop)
+        ], batch_size)
+
+    password_ids = list(Password.objects.filter(title__startswith='bench-').order_by('id')
+                        .values_list('id', flat=True))
+    bulk_insert(Organization.passwords.through, [
+        Organization.passwords.through(organization_id=organization_ids[i % organization_count], password_id=password_id)
+        for i, password_id in enumerate(password_ids)
+    ], batch_size)
+    bulk_insert(Share, [
+        Share(user_id=user_ids[(i + 1) % user_count], password_id=password_ids[i])
+        for i in range(share_count)
+    ], batch_size)
+    view_permission = Permission.objects.get(codename='view_password')
+    bulk_insert(Share.permissions.through, [
+        Share.permissions.through(share_id=share_id, permission_id=view_permission.id)
+        for share_id in Share.objects.filter(password_id__in=password_ids).values_list('id', flat=True)
+    ], batch_size)
+    # bulk_insert sends no signals
+    access.rebuild()
+
+    return {
+        'users': user_count,
+        'organizations': organization_count,
+        'passwords': passwords,
+        'shares': share_count,
+    }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def routes():
+    """
+    (name, method, path, body[, token]) for every route in core.urls, most
+    with one representative method. Paths, bodies and the optional token,
+    which replaces the benchmark user's access token, may be callables of
+    the request number.
+    """
+    user = User.objects.filter(email__startswith='bench').order_by('id').first()
+    own = Password.objects.filter(created_by=user).order_by('id').first()
+    owned = list(Password.objects.filter(created_by=user).order_by('id').values_list('id', flat=True)[:20])
+    shared = Share.objects.filter(user=user).order_by('id').first()
+    organization = user.organizations.order_by('id').first()
+    registrations, imports = count(), count()
+    refresh = str(RefreshToken.for_user(user))
+
+    # /api/audit/ and /api/metrics/ are for staff, and a revoked token must not be the one every other route uses
+    admin, _ = User.objects.get_or_create(email='admin-bench@example.com', defaults={'is_staff': True})
+    admin_token = str(AccessToken.for_user(admin))
+    event = AuditEvent.objects.create(action='reveal', user_id=user.id, password_id=own.id, created_at=timezone.now())
+
+    def import_file(i):
+        batch = next(imports)
+        rows = ''.join(json.dumps({'title': 'imported-%s-%s' % (batch, n), 'password': 'Imported#%s0rd' % n,
+                                   'duration_in_days': 30}) + '\n' for n in range(100))
+        return {'file': SimpleUploadedFile('passwords.ndjson', rows.encode(), 'application/x-ndjson')}
+
+    # A team of 50 and windows of 200 passwords, the revoke route undoes the share route
+    team = list(User.objects.filter(email__startswith='bench').order_by('id').values_list('id', flat=True)[:50])
+    password_ids = list(Password.objects.filter(title__startswith='bench-').order_by('id')
+                        .values_list('id', flat=True))
+
+    def bulk_shares(i):
+        start = i * 200 % max(len(password_ids) - 200, 1)
+        return {'users': team, 'passwords': password_ids[start:start + 200], 'permissions': ['view_password']}
+
+    return [
+        ('token', 'post', '/api/token/', {'email': user.email, 'password': BENCHMARK_PASSWORD}),
+        ('token_refresh', 'post', '/api/token/refresh/', {'refresh': refresh}),
+        ('token_revoke', 'post', '/api/token/revoke/', None, lambda i: str(AccessToken.for_user(user))),
+        ('register', 'post', '/api/register/', lambda i: {
+            'email': 'bench-register-%s@example.com' % next(registrations), 'first_name': 'Bench',
+            'last_name': 'Register', 'password': BENCHMARK_PASSWORD, 'confirmpswd': BENCHMARK_PASSWORD}),
+        ('passwords_list', 'get', '/api/passwords/', None),
+        ('passwords_list_no_secret', 'get', '/api/passwords/?include_secret=false', None),
+        ('passwords_retrieve', 'get', '/api/passwords/%s/' % own.id, None),
+        ('passwords_expiring', 'get', '/api/passwords/expiring/?within=7d', None),
+        ('passwords_reused', 'get', '/api/passwords/reused/', None),
+        ('passwords_search', 'get', lambda i: '/api/passwords/?search=bench-%s&page_size=10' % (i % 90 + 10), None),
+        ('passwords_import', 'post', '/api/passwords/import/', import_file),
+        ('passwords_export', 'get', '/api/passwords/export/', None),
+        ('async_passwords_list', 'get', '/api/async/passwords/', None),
+        ('async_passwords_retrieve', 'get', '/api/async/passwords/%s/' % own.id, None),
+        ('async_shared_passwords', 'get', '/api/async/shared_passwords/%s/' % shared.password_id, None),
+        ('organizations_list', 'get', '/api/organizations/', None),
+        ('organizations_search', 'get', '/api/organizations/?search=Org 1&page_size=10', None),
+        ('organizations_retrieve', 'get', '/api/organizations/%s/' % organization.id, None),
+        ('organizations_reused', 'get', '/api/organizations/%s/reused/' % organization.id, None),
+        ('organizations_members', 'post', '/api/organizations/%s/members/' % organization.id, {'user_ids': [user.id]}),
+        ('organizations_passwords', 'post', '/api/organizations/%s/passwords/' % organization.id,
+         {'passwords': owned}),
+        ('organizations_join', 'post', '/api/organizations/%s/join-as-member/' % organization.id,
+         {'email': user.email}),
+        ('organizations_add_passwords', 'post', '/api/organizations/%s/add-passwords/' % organization.id,
+         {'passwords': owned}),
+        ('shares_list', 'get', '/api/shares/', None),
+        ('shares_retrieve', 'get', '/api/shares/%s/' % shared.id, None),
+        ('shared_passwords', 'get', '/api/shared_passwords/%s/' % shared.password_id, None),
+        ('users_list', 'get', '/api/users/', None),
+        ('users_search', 'get', lambda i: '/api/users/?search=bench%s@&page_size=10' % (i % 90 + 10), None),
+        ('users_retrieve', 'get', '/api/users/%s/' % user.id, None),
+        ('users_me', 'get', '/api/users/me/', None),
+        ('permissions', 'get', '/api/permissions/', None),
+        ('sync', 'get', '/api/sync/?since=0&limit=500', None),
+        ('audit_list', 'get', '/api/audit/', None, admin_token),
+        ('audit_retrieve', 'get', '/api/audit/%s/' % event.id, None, admin_token),
+        ('metrics', 'get', '/api/metrics/', None, admin_token),
+        ('health', 'get', '/api/health/', None),
+        ('shares_bulk', 'post', '/api/shares/bulk/', bulk_shares),
+        ('shares_bulk_revoke', 'post', '/api/shares/bulk/revoke/', bulk_shares),
+    ], user
+
+
+def run(requests_per_route=50, only=None):
+    """
+    Drive every route through the test client and collect latency
+    percentiles, queries per request and throughput.
+    """
+    route_list, user = routes()
+    client = Client()
+    token = client.post('/api/token/', {'email': user.email, 'password': BENCHMARK_PASSWORD}).json()['access']
+    headers = {'HTTP_AUTHORIZATION': 'Bearer %s' % token}
+
+    results = {}
+    for name, method, path, body, *token in route_list:
+        if only and name not in only:
+            continue
+        timings, queries = [], []
+        for i in range(requests_per_route):
+            url = path(i) if callable(path) else path
+            data = body(i) if callable(body) else body
+            request_headers = headers
+            if token:
+                request_headers = {'HTTP_AUTHORIZATION': 'Bearer %s' % (token[0](i) if callable(token[0]) else token[0])}
+            # Uploads go multipart, every other body as JSON
+            upload = isinstance(data, dict) and any(hasattr(value, 'read') for value in data.values())
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data, **request_headers, **(
+                    {'content_type': 'application/json'} if method != 'get' and not upload else {}))
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append(time.perf_counter() - start)
+            queries.append(len(context.captured_queries))
+            # The flush thread of wsgi.py keeps audit writes off the request path. It cannot share the
+            # in-memory test database with a writing request, so flush between requests, untimed.
+            audit.buffer.flush()
+            if response.status_code >= 400:
+                raise RuntimeError('%s returned %s' % (name, response.status_code))
+        results[name] = {
+            'requests': requests_per_route,
+            'p50_ms': round(percentile(timings, 50) * 1000, 3),
+            'p95_ms': round(percentile(timings, 95) * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'queries': max(queries),
+            'throughput_rps': round(len(timings) / sum(timings), 1),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the regressions of results against a baseline: a p95 slower than
+    the tolerance allows or more queries per request.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append('%s: p95 %.2fms > baseline %.2fms' % (name, current['p95_ms'], previous['p95_ms']))
+        if current['queries'] > previous['queries']:
+            regressions.append('%s: %s queries > baseline %s' % (name, current['queries'], previous['queries']))
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)['routes']
@@ -0,0 +1,309 @@
+import base64
+import csv
+import io
+import json
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+
+from . import access, audit, sync
+from .models import Organization, Password, Share, User, share_permissions_cache_key
+from .serializers import PasswordImportSerializer
+from .util import encrypt, decrypt_many, fingerprint, password_strength
+
+EXPORT_FIELDS = ('id', 'title', 'password', 'date', 'duration_in_days', 'expired_at', 'strength')
+
+
+def read_rows(upload):
+    """
+    Yield (line number, row dict) from an uploaded CSV or NDJSON file.
+    """
+    text = io.TextIOWrapper(upload, encoding='utf-8')
+    if upload.name.lower().endswith('.csv'):
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            yield number, row
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        # None marks a line that is not a JSON object
+        yield number, row if isinstance(row, dict) else None
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_passwords(rows, user, batch_size=500):
+    """
+    Validate, encrypt and insert rows in chunks, one transaction per chunk.
+    Returns the number of created passwords and the per-row errors.
+    """
+    created, errors = 0, []
+    seen_titles = set()
+    for chunk in chunked(rows, batch_size):
+        valid = []
+        for number, row in chunk:
+            if row is None:
+                errors.append({'row': number, 'errors': {'non_field_errors': ['Invalid JSON object.']}})
+                continue
+            serializer = PasswordImportSerializer(data=row)
+            if not serializer.is_valid():
+                errors.append({'row': number, 'errors': serializer.errors})
+                continue
+            title = serializer.validated_data['title']
+            if title in seen_titles:
+                errors.append({'row': number, 'errors': {'title': ['Duplicate title in upload.']}})
+                continue
+            seen_titles.add(title)
+            valid.append((number, serializer.validated_data))
+
+        existing = set(Password.objects.filter(
+            title__in=[data['title'] for _, data in valid]).values_list('title', flat=True))
+        now = timezone.now()
+        passwords = []
+        for number, data in valid:
+            if data['title'] in existing:
+                errors.append({'row': number, 'errors': {'title': ['password with this title already exists.']}})
+                continue
+            cipher_text = encrypt(data['password'])
+            if cipher_text is None:
+                errors.append({'row': number, 'errors': {'password': ['Password could not be encrypted.']}})
+                continue
+            passwords.append(Password(
+                title=data['title'],
+                cipher_text=cipher_text,
+                strength=password_strength(data['password']),
+                fingerprint=fingerprint(data['password']),
+                duration_in_days=data['duration_in_days'],
+                expired_at=now + timedelta(days=data['duration_in_days']),
+                created_by=user,
+            ))
+        with transaction.atomic():
+            Password.objects.bulk_create(passwords, batch_size=batch_size)
+            # bulk_create skips post_save, log the new rows for /api/sync/ here
+            sync.record('password', [password.pk for password in passwords])
+            access.refresh([user.pk], [password.pk for password in passwords])
+        created += len(passwords)
+    errors.sort(key=lambda error: error['row'])
+    return created, errors
+
+
+def export_rows(queryset, include_secret=False, chunk_size=500, request=None):
+    """
+    Yield export dicts one by one, reading the queryset in chunks. The
+    password is the stored ciphertext unless include_secret is set, then
+    each revealed secret is audited against the request's user.
+    """
+    for chunk in chunked(queryset.order_by('id').iterator(chunk_size=chunk_size), chunk_size):
+        if include_secret:
+            secrets = decrypt_many([password.cipher_text for password in chunk])
+        for i, password in enumerate(chunk):
+            row = {field: getattr(password, field) for field in EXPORT_FIELDS}
+            if include_secret:
+                row['password'] = secrets[i]
+                if request is not None:
+                    audit.record('reveal', request.user, password_id=password.id, detail='export', request=request)
+            elif password.secret is not None:
+                row['password'] = base64.urlsafe_b64encode(password.cipher_text).decode('ascii')
+            for field in ('date', 'expired_at'):
+                row[field] = row[field].isoformat() if row[field] else None
+            yield row
+
+
+def stream_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def bulk_add_through(through, instance, reverse, model, related_ids, rows):
+    """
+    Insert through-table rows in one statement and send the m2m_changed
+    signals add() would, so receivers see the same pk_set.
+    """
+    with transaction.atomic():
+        m2m_changed.send(sender=through, action='pre_add', instance=instance, reverse=reverse,
+                         model=model, pk_set=set(related_ids), using='default')
+        through.objects.bulk_create(rows, ignore_conflicts=True)
+        m2m_changed.send(sender=through, action='post_add', instance=instance, reverse=reverse,
+                         model=model, pk_set=set(related_ids), using='default')
+
+
+def add_members(organization, emails, user_ids):
+    """
+    Add users by email or id in a few queries. Returns one result per item.
+    """
+    users = list(User.objects.annotate(email_lower=Lower('email')).filter(
+        Q(email_lower__in=[str(email).lower() for email in emails]) |
+        Q(id__in=[user_id for user_id in user_ids if str(user_id).isdigit()])
+    ).values_list('id', 'email'))
+    by_email = {email.lower(): user_id for user_id, email in users}
+    by_id = {user_id for user_id, _ in users}
+    through = User.organizations.through
+    members = set(through.objects.filter(organization=organization, user_id__in=by_id)
+                  .values_list('user_id', flat=True))
+
+    results, new_ids = [], []
+    items = [('email', email, by_email.get(str(email).lower())) for email in emails] + \
+            [('user_id', user_id, int(user_id) if str(user_id).isdigit() and int(user_id) in by_id else None)
+             for user_id in user_ids]
+    for kind, value, user_id in items:
+        if user_id is None:
+            status = 'not_found'
+        elif user_id in members or user_id in new_ids:
+            status = 'already_member'
+        else:
+            status = 'added'
+            new_ids.append(user_id)
+        results.append({kind: value, 'status': status})
+
+    if new_ids:
+        bulk_add_through(through, organization, True, User, new_ids, [
+            through(user_id=user_id, organization_id=organization.id) for user_id in new_ids
+        ])
+    return results
+
+
+def add_passwords(organization, password_ids, user):
+    """
+    Add passwords by id in a few queries. Returns one result per item,
+    passwords the user may not change are reported as not found.
+    """
+    ids = [int(password_id) for password_id in password_ids if str(password_id).isdigit()]
+    found = set(Password.objects.changeable_by(user).filter(id__in=ids).values_list('id', flat=True))
+    through = Organization.passwords.through
+    assigned = set(through.objects.filter(organization=organization, password_id__in=found)
+                   .values_list('password_id', flat=True))
+
+    results, new_ids = [], []
+    for password_id in password_ids:
+        password_id = int(password_id) if str(password_id).isdigit() else password_id
+        if password_id not in found:
+            status = 'not_found'
+        elif password_id in assigned or password_id in new_ids:
+            status = 'already_assigned'
+        else:
+            status = 'added'
+            new_ids.append(password_id)
+        results.append({'password': password_id, 'status': status})
+
+    if new_ids:
+        bulk_add_through(through, organization, False, Password, new_ids, [
+            through(organization_id=organization.id, password_id=password_id) for password_id in new_ids
+        ])
+    return results
+
+
+def audit_shares(action, request, shares):
+    """
+    One audit event per changed share, given as (share id, user id, password id).
+    """
+    # The codenames were resolved to the permission ids by the view
+    codenames = ','.join(sorted(request.data.get('permissions') or []))
+    for share_id, user_id, password_id in shares:
+        audit.record(action, request.user, password_id=password_id, share_id=share_id, target_user_id=user_id,
+                     detail=codenames, request=request)
+
+
+def share_many(user_ids, password_ids, permission_ids, batch_size=2000, request=None):
+    """
+    Share every password with every user, adding the permissions to shares
+    that already exist. Returns the number of shares and permission rows
+    created. With a request, the shares created or given permissions are
+    audited against its user.
+    """
+    through = Share.permissions.through
+    with transaction.atomic():
+        existing = set(Share.objects.filter(user_id__in=user_ids, password_id__in=password_ids)
+                       .values_list('user_id', 'password_id'))
+        new_pairs = [(user_id, password_id) for user_id in user_ids for password_id in password_ids
+                     if (user_id, password_id) not in existing]
+        Share.objects.bulk_create([Share(user_id=user_id, password_id=password_id)
+                                   for user_id, password_id in new_pairs], batch_size=batch_size)
+
+        # Re-read the ids, bulk_create does not return them on every backend
+        pairs = {share_id: (user_id, password_id) for share_id, user_id, password_id in
+                 Share.objects.filter(user_id__in=user_ids, password_id__in=password_ids)
+                 .values_list('id', 'user_id', 'password_id')}
+        shares = {share_id: user_id for share_id, (user_id, _) in pairs.items()}
+        granted = set(through.objects.filter(share_id__in=shares, permission_id__in=permission_ids)
+                      .values_list('share_id', 'permission_id'))
+        rows = [through(share_id=share_id, permission_id=permission_id)
+                for share_id in shares for permission_id in permission_ids
+                if (share_id, permission_id) not in granted]
+        through.objects.bulk_create(rows, batch_size=batch_size)
+
+        # bulk_create sends no signals, do what the receivers would
+        new_users = {user_id for user_id, _ in new_pairs}
+        sync.record_access('password', set(new_pairs) | {pairs[row.share_id] for row in rows})
+        sync.record('share', sorted({row.share_id for row in rows} |
+                                    {share_id for share_id, user_id in shares.items() if user_id in new_users}))
+        access.refresh(user_ids, password_ids)
+    cache.delete_many([share_permissions_cache_key(user_id, password_id)
+                       for user_id in user_ids for password_id in password_ids])
+    if request is not None:
+        created = set(new_pairs)
+        changed = {row.share_id for row in rows} | {share_id for share_id, pair in pairs.items() if pair in created}
+        audit_shares('share_grant', request, [(share_id,) + pairs[share_id] for share_id in sorted(changed)])
+    return len(new_pairs), len(rows)
+
+
+def revoke_many(user_ids, password_ids, permission_ids=None, request=None):
+    """
+    Remove the permissions from the matching shares, or delete the shares
+    when no permissions are given. Returns the number of rows removed. With
+    a request, the shares deleted or losing permissions are audited against
+    its user.
+    """
+    shares = Share.objects.filter(user_id__in=user_ids, password_id__in=password_ids)
+    with transaction.atomic():
+        changed = []
+        if request is not None:
+            affected = shares if permission_ids is None else shares.filter(
+                permissions__in=permission_ids).distinct()
+            changed = list(affected.order_by('id').values_list('id', 'user_id', 'password_id'))
+        if permission_ids is None:
+            # Collected deletes still send post_delete, which logs lost access
+            with access.deferred():
+                _, by_model = shares.delete()
+            removed = by_model.get(Share._meta.label, 0)
+        else:
+            through = Share.permissions.through
+            share_ids = list(shares.values_list('id', flat=True))
+            removed, _ = through.objects.filter(share_id__in=share_ids, permission_id__in=permission_ids).delete()
+            if removed:
+                sync.record('share', share_ids)
+                access.refresh(user_ids, password_ids)
+    cache.delete_many([share_permissions_cache_key(user_id, password_id)
+                       for user_id in user_ids for password_id in password_ids])
+    if request is not None:
+        audit_shares('share_revoke', request, changed)
+    return removed
@@ -0,0 +1,54 @@
+"""
+Caching for near-static lookups such as the permission catalogue.
+
+A lookup is built once per process and shared through the cache. It is
+stored as its JSON payload together with an ETag. Every entry is keyed
+by a global version that post_migrate replaces, so a migration invalidates
+all processes at once. The version is random so a cache flush cannot bring
+back a version some process still holds.
+"""
+import hashlib
+import json
+import uuid
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+VERSION_KEY = 'lookup_version'
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+class CachedLookup:
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self._local = {}
+
+    def get(self):
+        """
+        Return (payload, etag), payload being the JSON encoded lookup.
+        """
+        version = current_version()
+        entry = self._local.get(version)
+        if entry is None:
+            key = 'lookup:%s:%s' % (self.name, version)
+            entry = cache.get(key)
+            if entry is None:
+                payload = json.dumps(self.build(), cls=DjangoJSONEncoder).encode()
+                entry = (payload, '"%s"' % hashlib.sha1(payload).hexdigest())
+                cache.set(key, entry, None)
+            # Older versions are never read again
+            self._local = {version: entry}
+        return entry
@@ -0,0 +1,80 @@
+"""
+Cipher backends for stored password secrets, selected by ENCRYPT_BACKEND.
+
+fernet is the original format: a Fernet token base64 encoded once more
+and stored as text in Password.password. aesgcm stores raw AES-256-GCM
+output in the binary Password.secret column:
+
+    version (1) | key id (4) | nonce (12) | ciphertext | tag (16)
+
+Version and key id are authenticated as associated data. aesgcm keys are
+derived from ENCRYPT_KEY and ENCRYPT_OLD_KEYS with HKDF, so both backends
+rotate with the same settings, and the key id picks the decryption key
+instead of trying each key in turn.
+"""
+import base64
+import hashlib
+import os
+
+from cryptography.fernet import Fernet, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+
+class FernetBackend:
+    name = 'fernet'
+
+    def __init__(self, keys):
+        self.cipher = MultiFernet([Fernet(key) for key in keys])
+
+    @staticmethod
+    def handles(value):
+        return isinstance(value, str)
+
+    def encrypt(self, data):
+        return base64.urlsafe_b64encode(self.cipher.encrypt(data)).decode('ascii')
+
+    def decrypt(self, value):
+        return self.cipher.decrypt(base64.urlsafe_b64decode(value))
+
+    def is_current(self, value):
+        # Tokens carry no key id, rotation always re-encrypts them
+        return False
+
+
+class AESGCMBackend:
+    name = 'aesgcm'
+    version = b'\x01'
+    overhead = 1 + 4 + 12 + 16
+
+    def __init__(self, keys):
+        self.keys = {}
+        for key in keys:
+            derived = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                           info=b'core.ciphers.aesgcm').derive(base64.urlsafe_b64decode(key))
+            self.keys.setdefault(hashlib.sha256(derived).digest()[:4], AESGCM(derived))
+        self.primary = next(iter(self.keys))
+
+    @classmethod
+    def handles(cls, value):
+        return isinstance(value, (bytes, memoryview)) and bytes(value[:1]) == cls.version
+
+    def encrypt(self, data):
+        header = self.version + self.primary
+        nonce = os.urandom(12)
+        return header + nonce + self.keys[self.primary].encrypt(nonce, data, header)
+
+    def decrypt(self, value):
+        value = bytes(value)
+        header, nonce, cipher_text = value[:5], value[5:17], value[17:]
+        return self.keys[header[1:]].decrypt(nonce, cipher_text, header)
+
+    def is_current(self, value):
+        return bytes(value[1:5]) == self.primary
+
+
+BACKENDS = {
+    FernetBackend.name: FernetBackend,
+    AESGCMBackend.name: AESGCMBackend,
+}
@@ -0,0 +1,71 @@
+"""
+ETag and Last-Modified support for viewsets backed by models with an
+updated_at column. A matching If-None-Match or If-Modified-Since request
+gets a 304 before any decryption or serialization runs.
+"""
+import hashlib
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+class ConditionalMixin:
+    """
+    Adds validators to list and retrieve, and ?changed_since=<ISO datetime>
+    to only list what changed after that time.
+    """
+    changed_since_param = 'changed_since'
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        value = self.request.query_params.get(self.changed_since_param)
+        if not value:
+            return queryset
+        changed_since = parse_datetime(value)
+        if changed_since is None:
+            raise ValidationError({self.changed_since_param: 'Must be an ISO 8601 datetime.'})
+        return queryset.filter(updated_at__gt=changed_since)
+
+    def collection_aggregates(self):
+        return {
+            'count': Count('id'),
+            'last_modified': Max('updated_at'),
+            'ids': Sum('id'),
+        }
+
+    def resource_etag_parts(self, instance):
+        return (instance.pk, instance.updated_at.isoformat())
+
+    def conditional(self, request, etag, last_modified, render):
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified.timestamp() if last_modified else None)
+        if response is None:
+            response = render()
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        # The representation depends on the user, the query string and the rows
+        aggregates = self.filter_queryset(self.get_queryset()).order_by().aggregate(**self.collection_aggregates())
+        etag = make_etag(request.user.pk, request.get_full_path(), *sorted(aggregates.items()))
+        return self.conditional(request, etag, aggregates['last_modified'],
+                                lambda: super(ConditionalMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = make_etag(request.get_full_path(), *self.resource_etag_parts(instance))
+
+        def render():
+            serializer = self.get_serializer(instance)
+            return Response(serializer.data)
+        return self.conditional(request, etag, instance.updated_at, render)
@@ -0,0 +1,21 @@
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# WAL lets readers run alongside the single writer, NORMAL sync is safe under WAL
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=20000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-64000',
+    'PRAGMA mmap_size=268435456',
+)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
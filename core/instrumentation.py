@@ -0,0 +1,151 @@
+"""
+Opt-in per-request timings for the hot paths of the API.
+
+Code marks a section with ``with timed('crypto'):`` (or ``@timed('crypto')``).
+Outside of an instrumented request this costs a single context variable
+lookup. InstrumentationMiddleware collects the timings together with the
+query count and DB time, returns them in a Server-Timing header and feeds
+in-process histograms served by the metrics view.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+_current = ContextVar('instrumentation', default=None)
+
+# Upper bounds in milliseconds, the last bucket is unbounded
+BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class RequestTimings:
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.active = set()
+        self.queries = 0
+
+
+class timed(ContextDecorator):
+    """
+    Add the time spent in the block to the current request under name.
+    Nested blocks with the same name are only counted once.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def _recreate_cm(self):
+        # Decorated functions get a fresh instance per call, they may run in parallel
+        return self.__class__(self.name)
+
+    def __enter__(self):
+        timings = _current.get()
+        if timings is None or self.name in timings.active:
+            self._timings = None
+            return self
+        self._timings = timings
+        timings.active.add(self.name)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._timings is not None:
+            self._timings.durations[self.name] += time.perf_counter() - self._start
+            self._timings.active.discard(self.name)
+        return False
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        bounds = [str(bound) for bound in BUCKETS] + ['+Inf']
+        return {'count': self.count, 'sum': round(self.sum, 3), 'buckets': dict(zip(bounds, self.counts))}
+
+
+class Registry:
+    """
+    Histograms keyed by (view name, metric), safe to update from any thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(Histogram)
+
+    def observe(self, view_name, values):
+        with self._lock:
+            for metric, value in values.items():
+                self._histograms[(view_name, metric)].observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = defaultdict(dict)
+            for (view_name, metric), histogram in self._histograms.items():
+                snapshot[view_name][metric] = histogram.as_dict()
+            return dict(snapshot)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+registry = Registry()
+
+
+class InstrumentationMiddleware:
+    """
+    Records query count, DB time, crypto, hashing, JWT and serializer time
+    per request. Enabled with INSTRUMENTATION_ENABLED.
+    """
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            with connections['default'].execute_wrapper(self.record_query(timings)):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        durations = dict(timings.durations)
+        durations['total'] = time.perf_counter() - start
+
+        values = {name: duration * 1000 for name, duration in durations.items()}
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.2f' % (name, value) if name != 'db'
+            else 'db;desc="%s queries";dur=%.2f' % (timings.queries, value)
+            for name, value in sorted(values.items())
+        )
+        values['queries'] = timings.queries
+        match = getattr(request, 'resolver_match', None)
+        registry.observe(match.view_name if match else 'unresolved', values)
+        return response
+
+    @staticmethod
+    def record_query(timings):
+        def wrapper(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timings.durations['db'] += time.perf_counter() - start
+                timings.queries += 1
+        return wrapper
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Password
+from core.util import decrypt_many, fingerprint
+
+
+class Command(BaseCommand):
+    help = 'Compute and store Password.fingerprint for rows that do not have it yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every fingerprint, needed after FINGERPRINT_KEY changes')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Password.objects.order_by('id').only('id', 'password', 'secret')
+        if not options['all']:
+            queryset = queryset.filter(fingerprint__isnull=True)
+
+        last_id, updated, failed = 0, 0, 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            plaintexts = decrypt_many([password.cipher_text for password in batch])
+            for password, plaintext in zip(batch, plaintexts):
+                password.fingerprint = fingerprint(plaintext)
+                failed += plaintext is None
+            # Not part of any API representation, so updated_at and the change log stay as they are
+            Password.objects.bulk_update(batch, ['fingerprint'])
+            last_id = batch[-1].id
+            updated += len(batch)
+            self.stdout.write('Updated %s passwords' % updated)
+
+        self.stdout.write(self.style.SUCCESS('Backfilled fingerprints for %s passwords, %s could not be decrypted'
+                                             % (updated - failed, failed)))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core import sync
+from core.models import Password
+from core.util import decrypt, password_strength
+
+
+class Command(BaseCommand):
+    help = 'Compute and store Password.strength for rows that do not have it yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute strength for every row, not only missing ones')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Password.objects.order_by('id').only('id', 'password', 'secret')
+        if not options['all']:
+            queryset = queryset.filter(strength__isnull=True)
+
+        last_id, updated = 0, 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            now = timezone.now()
+            for password in batch:
+                password.strength = password_strength(decrypt(password.cipher_text))
+                password.updated_at = now
+            with transaction.atomic():
+                Password.objects.bulk_update(batch, ['strength', 'updated_at'])
+                sync.record('password', [password.id for password in batch])
+            last_id = batch[-1].id
+            updated += len(batch)
+            self.stdout.write('Updated %s passwords' % updated)
+
+        self.stdout.write(self.style.SUCCESS('Backfilled strength for %s passwords' % updated))
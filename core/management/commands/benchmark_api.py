@@ -0,0 +1,54 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database and benchmark every route in core.urls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='1k',
+                            help='Number of passwords: %s or a plain number' % ', '.join(benchmarks.SCALES))
+        parser.add_argument('--requests', type=int, default=50, help='Requests per route')
+        parser.add_argument('--route', action='append', help='Only run these routes')
+        parser.add_argument('--output', help='Write the results as a JSON baseline')
+        parser.add_argument('--compare', help='Fail if results regress against this JSON baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p95 slowdown against the baseline, 0.25 is 25%%')
+
+    def handle(self, *args, **options):
+        scale = options['scale'].lower()
+        passwords = benchmarks.SCALES.get(scale) or int(scale)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            start = time.perf_counter()
+            sizes = benchmarks.seed(passwords)
+            self.stdout.write('Seeded %s in %.1fs' % (sizes, time.perf_counter() - start))
+            results = benchmarks.run(options['requests'], options['route'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write('%-28s %9s %9s %9s %8s %10s' % ('route', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'req/s'))
+        for name, result in results.items():
+            self.stdout.write('%-28s %9.2f %9.2f %9.2f %8d %10.1f' % (
+                name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['queries'],
+                result['throughput_rps']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'scale': sizes, 'vendor': connection.vendor, 'routes': results}, f, indent=2)
+
+        if options['compare']:
+            regressions = benchmarks.compare(results, benchmarks.load_baseline(options['compare']),
+                                             options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against baseline:\n%s' % '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against %s' % options['compare']))
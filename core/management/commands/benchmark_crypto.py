@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from core.ciphers import BACKENDS
+from core.util import encrypt_many, decrypt_many
+
+
+class Command(BaseCommand):
+    help = 'Benchmark encrypt_many/decrypt_many throughput and stored size per cipher backend and worker count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--values', type=int, default=20000)
+        parser.add_argument('--workers', default='1,2,4,8',
+                            help='Comma separated worker counts to compare')
+        parser.add_argument('--backends', default=','.join(BACKENDS),
+                            help='Comma separated cipher backends to compare')
+        parser.add_argument('--length', type=int, default=16, help='Plaintext length')
+
+    def handle(self, *args, **options):
+        values = [('Secret#%08d' % i).ljust(options['length'], 'x') for i in range(options['values'])]
+
+        for backend in options['backends'].split(','):
+            with override_settings(ENCRYPT_BACKEND=backend):
+                cipher_texts = encrypt_many(values, workers=1)
+                # Stored bytes per row: fernet text in Password.password, aesgcm bytes in Password.secret
+                sizes = [len(cipher_text) for cipher_text in cipher_texts]
+                self.stdout.write('%-8s %d byte plaintext: %.1f bytes stored on average, %d over 128' % (
+                    backend, options['length'], sum(sizes) / len(sizes), sum(size > 128 for size in sizes)))
+
+                for workers in [int(workers) for workers in options['workers'].split(',')]:
+                    for name, func, batch in (('encrypt', encrypt_many, values),
+                                              ('decrypt', decrypt_many, cipher_texts)):
+                        start = time.perf_counter()
+                        func(batch, workers=workers)
+                        elapsed = time.perf_counter() - start
+                        self.stdout.write('%-8s %-8s workers=%-3d %10.0f values/s' % (
+                            backend, name, workers, len(batch) / elapsed))
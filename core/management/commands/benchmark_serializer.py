@@ -0,0 +1,68 @@
+import re
+import time
+import base64
+from datetime import timedelta
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from rest_framework import serializers
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Password
+from core.serializers import PasswordSerializer
+from core.util import get_cipher
+
+
+class LegacyPasswordSerializer(PasswordSerializer):
+    """
+    PasswordSerializer as it was before the decrypt-once pipeline: a new
+    Fernet per call, one decryption per derived field and strength
+    computed on every read.
+    """
+    strength = serializers.SerializerMethodField(read_only=True)
+
+    class Meta(PasswordSerializer.Meta):
+        # The plain list serializer, without the batched decryption of PasswordListSerializer
+        list_serializer_class = serializers.ListSerializer
+
+    def legacy_decrypt(self, pas):
+        return Fernet(settings.ENCRYPT_KEY).decrypt(base64.urlsafe_b64decode(pas)).decode("ascii")
+
+    def get_decrypt_password(self, obj):
+        return self.legacy_decrypt(obj.password)
+
+    def get_strength(self, obj):
+        if(bool(re.match('((?=.*\d)(?=.*[a-z])(?=.*[A-Z])(?=.*[!@#$%^&*]).{8,30})',self.legacy_decrypt(obj.password)))==True):
+            return "Strong"
+        elif(bool(re.match('((\d*)([a-z]*)([A-Z]*)([!@#$%^&*]*).{8,30})',self.legacy_decrypt(obj.password)))==True):
+            return "Weak"
+
+
+class Command(BaseCommand):
+    help = 'Benchmark per-row cost of serializing passwords, before and after decrypt-once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        now = timezone.now()
+        # Unsaved instances: the benchmark measures serialization, not the ORM.
+        # Fernet text, the only format the legacy serializer reads
+        passwords = [
+            Password(id=i, title='title-%s' % i, cipher_text=get_cipher('fernet').encrypt(b'weakpassword%d' % i),
+                     date=now, duration_in_days=30, expired_at=now + timedelta(days=30))
+            for i in range(rows)
+        ]
+
+        for name, serializer_class in (('before', LegacyPasswordSerializer), ('after', PasswordSerializer)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                serializer_class(passwords, many=True).data
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write('%-6s %8.2f us/row (%d rows, best of %d)' % (
+                name, best / rows * 1e6, rows, repeat))
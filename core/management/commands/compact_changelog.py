@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import sync
+
+
+class Command(BaseCommand):
+    help = 'Remove change log entries superseded by newer entries for the same object'
+
+    def handle(self, *args, **options):
+        deleted = sync.compact()
+        self.stdout.write(self.style.SUCCESS('Removed %s change log entries' % deleted))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import access
+
+
+class Command(BaseCommand):
+    help = 'Recompute the password access table from created_by, organizations and shares'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify the table, fail if it differs from the source relations')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users refreshed per batch')
+
+    def handle(self, *args, **options):
+        inserted, updated, deleted = access.rebuild(options['batch_size'], dry_run=options['check'])
+        if options['check']:
+            if inserted or updated or deleted:
+                raise CommandError('Password access is out of date: %s missing, %s wrong, %s stale rows'
+                                   % (inserted, updated, deleted))
+            self.stdout.write(self.style.SUCCESS('Password access matches the source relations'))
+            return
+        self.stdout.write(self.style.SUCCESS('Inserted %s, updated %s and deleted %s rows'
+                                             % (inserted, updated, deleted)))
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Password
+from core.util import decrypt_many, fingerprint, rotate
+
+
+class Command(BaseCommand):
+    help = ('Re-encrypt every password with the primary ENCRYPT_KEY and ENCRYPT_BACKEND, in id-ordered chunks, '
+            'recomputing fingerprints keyed from it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--start-id', type=int, default=0,
+                            help='Resume after this password id, as printed by a previous run')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between chunks to throttle the rotation')
+
+    def handle(self, *args, **options):
+        batch_size, last_id = options['batch_size'], options['start_id']
+        rotated, failed = 0, 0
+        start = time.perf_counter()
+
+        while True:
+            batch = list(Password.objects.filter(id__gt=last_id).order_by('id')
+                         .only('id', 'password', 'secret', 'fingerprint')[:batch_size])
+            if not batch:
+                break
+            # Without FINGERPRINT_KEY fingerprints are keyed from ENCRYPT_KEY, so they change with it
+            plaintexts = decrypt_many([password.cipher_text for password in batch])
+            with transaction.atomic():
+                for password, plaintext in zip(batch, plaintexts):
+                    cipher_text = password.cipher_text
+                    new_cipher_text = rotate(cipher_text)
+                    if new_cipher_text is None or plaintext is None:
+                        failed += 1
+                        continue
+                    new_fingerprint = fingerprint(plaintext)
+                    if new_cipher_text == cipher_text and new_fingerprint == password.fingerprint:
+                        continue
+                    read = {'password': password.password, 'secret': password.secret}
+                    password.cipher_text = new_cipher_text
+                    # Only overwrite the value we read, a concurrent update wins
+                    rotated += Password.objects.filter(id=password.id, **read).update(
+                        password=password.password, secret=password.secret, fingerprint=new_fingerprint)
+            last_id = batch[-1].id
+            elapsed = time.perf_counter() - start
+            self.stdout.write('last id %s: %s rotated, %s failed, %.0f rows/s' % (
+                last_id, rotated, failed, rotated / elapsed if elapsed else 0))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS('Rotated %s passwords, %s failed' % (rotated, failed)))
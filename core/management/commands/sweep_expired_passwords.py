@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Password
+from core.signals import passwords_expired
+
+
+class Command(BaseCommand):
+    help = 'Notify about passwords that expired since the last sweep, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        queryset = Password.objects.filter(expired_at__lte=now, expiry_notified_at__isnull=True).order_by('id')
+        last_id, notified = 0, 0
+
+        while True:
+            batch = list(queryset.filter(id__gt=last_id).only('id', 'title', 'expired_at', 'created_by_id')
+                         [:options['batch_size']])
+            if not batch:
+                break
+            passwords_expired.send(sender=self.__class__, passwords=batch)
+            Password.objects.filter(id__in=[password.id for password in batch]).update(expiry_notified_at=now)
+            last_id = batch[-1].id
+            notified += len(batch)
+
+        self.stdout.write(self.style.SUCCESS('Notified %s expired passwords' % notified))
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-18 06:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_password_created_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='password',
+            name='strength',
+            field=models.CharField(blank=True, choices=[('Strong', 'Strong'), ('Weak', 'Weak')], db_index=True, max_length=10, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.3 on 2026-10-18 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_password_strength'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='share',
+            index=models.Index(fields=['user', 'password'], name='core_share_user_id_64d647_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.3 on 2026-10-18 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_share_user_password_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='password',
+            name='expiry_notified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='password',
+            name='expired_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
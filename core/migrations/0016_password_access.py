@@ -0,0 +1,59 @@
+# Generated by Django 4.1.3 on 2026-10-18 07:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from collections import defaultdict
+
+# Copies of PasswordAccess.OWNER, ORGANIZATION, SHARED and PERMISSION_BITS
+OWNER, ORGANIZATION, SHARED = 1, 2, 4
+PERMISSION_BITS = {'view_password': 8, 'add_password': 16, 'change_password': 32, 'delete_password': 64}
+
+
+def populate(apps, schema_editor):
+    Password = apps.get_model('core', 'Password')
+    Organization = apps.get_model('core', 'Organization')
+    User = apps.get_model('core', 'User')
+    Share = apps.get_model('core', 'Share')
+    PasswordAccess = apps.get_model('core', 'PasswordAccess')
+
+    masks = defaultdict(int)
+    for user_id, password_id in Password.objects.filter(created_by__isnull=False).values_list('created_by_id', 'id'):
+        masks[user_id, password_id] |= OWNER
+    memberships = defaultdict(list)
+    for user_id, organization_id in User.organizations.through.objects.values_list('user_id', 'organization_id'):
+        memberships[organization_id].append(user_id)
+    for organization_id, password_id in Organization.passwords.through.objects.values_list(
+            'organization_id', 'password_id'):
+        for user_id in memberships[organization_id]:
+            masks[user_id, password_id] |= ORGANIZATION
+    for user_id, password_id, codename in Share.objects.values_list('user_id', 'password_id', 'permissions__codename'):
+        masks[user_id, password_id] |= SHARED | PERMISSION_BITS.get(codename, 0)
+    PasswordAccess.objects.bulk_create([
+        PasswordAccess(user_id=user_id, password_id=password_id, mask=mask)
+        for (user_id, password_id), mask in masks.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_changelog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PasswordAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mask', models.PositiveIntegerField()),
+                ('password', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='core.password')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='password_access', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='passwordaccess',
+            constraint=models.UniqueConstraint(fields=('user', 'password'), name='unique_password_access'),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.3 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_password_access'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='password',
+            name='secret',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='password',
+            name='password',
+            field=models.CharField(blank=True, max_length=128, verbose_name='password'),
+        ),
+    ]
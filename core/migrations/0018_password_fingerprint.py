@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-18 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_password_secret'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='password',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.3 on 2026-10-18 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_password_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('reveal', 'reveal'), ('shared_access', 'shared_access'), ('share_create', 'share_create'), ('share_update', 'share_update'), ('share_delete', 'share_delete'), ('share_grant', 'share_grant'), ('share_revoke', 'share_revoke')], max_length=20)),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('password_id', models.BigIntegerField(blank=True, null=True)),
+                ('share_id', models.BigIntegerField(blank=True, null=True)),
+                ('target_user_id', models.BigIntegerField(blank=True, null=True)),
+                ('detail', models.CharField(blank=True, max_length=255)),
+                ('remote_addr', models.GenericIPAddressField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='auditevent',
+            index=models.Index(fields=['user_id', 'created_at'], name='core_audite_user_id_69cb1f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditevent',
+            index=models.Index(fields=['password_id', 'created_at'], name='core_audite_passwor_5e5a15_idx'),
+        ),
+    ]
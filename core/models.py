@@ -1,9 +1,16 @@
 from django.db import models
+from django.db.models import Case, Count, F, Value, When
+from django.db.models.lookups import GreaterThan
 from django.contrib.auth.base_user import BaseUserManager
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import Permission
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+
+from .util import upgrade
 
 # Create your models here.
 class CustomUserManager(BaseUserManager):
@@ -64,35 +71,170 @@ class User(AbstractUser):
         passwords = Password.objects.filter(organization_passwords__in=organizations).values_list('id', flat=True)
         return passwords
     
-    def has_perms_in_password(self, password_id, perms):
-        password = get_object_or_404(Password, id=password_id)
-        shares = Share.objects.values_list('id', flat=True).filter(user=self, password_id=password_id)
+    def password_permissions(self, password_id):
+        """
+        Codenames of the permissions shared with this user on a password.
+        Read from the PasswordAccess mask, memoized on the user for the
+        request and optionally cached for SHARE_PERMISSIONS_CACHE_TIMEOUT
+        seconds.
+        """
+        memo = self.__dict__.setdefault('_password_permissions', {})
+        password_id = int(password_id)
+        if password_id in memo:
+            return memo[password_id]
 
-        return bool(Permission.objects.filter(share_permissions__in=shares, codename__in=perms).exists())
+        timeout = settings.SHARE_PERMISSIONS_CACHE_TIMEOUT
+        key = share_permissions_cache_key(self.id, password_id)
+        perms = cache.get(key) if timeout else None
+        if perms is None:
+            mask = PasswordAccess.objects.filter(user_id=self.id, password_id=password_id).values_list(
+                'mask', flat=True).first()
+            perms = PasswordAccess.codenames(mask or 0)
+            if timeout:
+                cache.set(key, perms, timeout)
+        memo[password_id] = perms
+        return perms
+
+    def has_perms_in_password(self, password_id, perms):
+        granted = self.password_permissions(password_id)
+        if not granted and not Password.objects.filter(id=password_id).exists():
+            raise Http404
+        return bool(granted.intersection(perms))
 
     def has_perm_in_password(self, password_id, perm):
         return self.has_perms_in_password(password_id, [perm])
 
 
+class ClaimsUser(User):
+    """
+    User rebuilt from signed JWT claims without a database lookup. It only
+    carries the fields embedded in the token and cannot be saved.
+    """
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def from_claims(cls, token):
+        user = cls(
+            id=token['user_id'],
+            email=token['email'],
+            first_name=token['first_name'],
+            last_name=token['last_name'],
+            is_staff=token['is_staff'],
+            is_superuser=token['is_superuser'],
+            is_active=True,
+        )
+        user._state.adding = False
+        user._state.db = 'default'
+        return user
+
+    def save(self, *args, **kwargs):
+        raise NotImplementedError('ClaimsUser is read only, load a User to change it.')
+
+
+def share_permissions_cache_key(user_id, password_id):
+    return 'share_permissions:%s:%s' % (user_id, password_id)
+
+
+class PasswordQuerySet(models.QuerySet):
+
+    def visible_to(self, user, permission='view_password'):
+        """
+        Passwords the user created, reaches through an organization or
+        has been shared with the permission, read from the PasswordAccess
+        table with one lookup on its (user, password) index.
+        """
+        bits = PasswordAccess.OWNER | PasswordAccess.ORGANIZATION | PasswordAccess.PERMISSION_BITS[permission]
+        return self.filter(id__in=PasswordAccess.objects.filter(
+            GreaterThan(F('mask').bitand(bits), 0), user=user).values('password_id'))
+
+    def changeable_by(self, user):
+        """
+        Passwords the user created or has been shared with change_password,
+        the ones the user may hand on to other users or organizations.
+        """
+        bits = PasswordAccess.OWNER | PasswordAccess.PERMISSION_BITS['change_password']
+        return self.filter(id__in=PasswordAccess.objects.filter(
+            GreaterThan(F('mask').bitand(bits), 0), user=user).values('password_id'))
+
+    def with_status(self):
+        """
+        Annotate expiry_status ('Expired' or 'Not expired') in SQL.
+        """
+        # timezone.now() rather than Now(), SQLite's CURRENT_TIMESTAMP drops microseconds
+        return self.annotate(expiry_status=Case(
+            When(expired_at__lte=timezone.now(), then=Value('Expired')),
+            default=Value('Not expired'),
+        ))
+
+    def reused(self):
+        """
+        Fingerprints shared by more than one password, with their count.
+        """
+        return self.filter(fingerprint__isnull=False).values('fingerprint').annotate(
+            count=Count('id')).filter(count__gt=1).order_by('-count', 'fingerprint')
+
+    def expiring_within(self, delta):
+        now = timezone.now()
+        return self.filter(expired_at__gt=now, expired_at__lte=now + delta)
+
 
 class Password(models.Model):
+    strength_options = (
+        ('Strong', 'Strong'),
+        ('Weak', 'Weak'),
+    )
     title = models.CharField(max_length=128, unique=True)
-    password = models.CharField(_("password"), max_length=128)
+    # Legacy fernet text, empty once the secret is stored in the binary column
+    password = models.CharField(_("password"), max_length=128, blank=True)
+    secret = models.BinaryField(null=True, blank=True)
     date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     duration_in_days = models.IntegerField()
-    expired_at = models.DateTimeField(blank=True, null=True)
+    expired_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    expiry_notified_at = models.DateTimeField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='password_created_by', null=True, blank=True)
+    strength = models.CharField(max_length=10, choices=strength_options, null=True, blank=True, db_index=True)
+    # Keyed hash of the plaintext, equal for reused secrets
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+
+    objects = PasswordQuerySet.as_manager()
     
     def __str__(self):
         return self.title
 
+    @property
+    def cipher_text(self):
+        """
+        The stored secret in whichever format it was written, see core.ciphers.
+        """
+        return bytes(self.secret) if self.secret is not None else self.password
+
+    @cipher_text.setter
+    def cipher_text(self, value):
+        if isinstance(value, str) or value is None:
+            self.password, self.secret = value, None
+        else:
+            self.password, self.secret = '', value
+
+    def save(self, *args, **kwargs):
+        # Secrets in an older format move to ENCRYPT_BACKEND whenever the row is written
+        if not {'password', 'secret'} & self.get_deferred_fields():
+            cipher_text = self.cipher_text
+            upgraded = upgrade(cipher_text)
+            if upgraded is not None and upgraded != cipher_text:
+                self.cipher_text = upgraded
+                if kwargs.get('update_fields') is not None:
+                    kwargs['update_fields'] = set(kwargs['update_fields']) | {'password', 'secret'}
+        super().save(*args, **kwargs)
+
 # Organization Model
 class Organization(models.Model):
     name = models.CharField(max_length=50, verbose_name='Name', null=True)
     organizationId = models.CharField(max_length=10, unique=True, verbose_name='Organization id', null=True)
     organizationSize = models.CharField(max_length=15, verbose_name='Organization Size', null=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     passwords = models.ManyToManyField(Password, blank=True, related_name='organization_passwords')
 
     def __str__(self):
@@ -101,4 +243,97 @@ class Organization(models.Model):
 class Share(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     password = models.ForeignKey(Password, on_delete=models.CASCADE)
-    permissions = models.ManyToManyField(Permission, related_name='share_permissions', blank=True)
\ No newline at end of file
+    permissions = models.ManyToManyField(Permission, related_name='share_permissions', blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'password']),
+        ]
+
+class ChangeLog(models.Model):
+    """
+    Append-only feed of changes replicated by /api/sync/. Entries without a
+    user apply to everyone who can see the object, entries with a user
+    record that this user gained or lost access to it.
+    """
+    models_options = (
+        ('password', 'password'),
+        ('organization', 'organization'),
+        ('share', 'share'),
+    )
+    actions = (
+        ('upsert', 'upsert'),
+        ('delete', 'delete'),
+    )
+    model = models.CharField(max_length=20, choices=models_options)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=actions)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'object_id']),
+        ]
+
+
+class PasswordAccess(models.Model):
+    """
+    Materialized user -> password access, one row per pair the user can
+    see. The mask records how the user reaches the password and which
+    password permissions were shared with them. Kept up to date by the
+    receivers in core.signals, see core.access.
+    """
+    OWNER = 1
+    ORGANIZATION = 2
+    SHARED = 4
+    PERMISSION_BITS = {
+        'view_password': 8,
+        'add_password': 16,
+        'change_password': 32,
+        'delete_password': 64,
+    }
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='password_access')
+    password = models.ForeignKey(Password, on_delete=models.CASCADE, related_name='access')
+    mask = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'password'], name='unique_password_access'),
+        ]
+
+    @classmethod
+    def codenames(cls, mask):
+        return frozenset(codename for codename, bit in cls.PERMISSION_BITS.items() if mask & bit)
+
+
+class AuditEvent(models.Model):
+    """
+    Append-only audit trail written in batches by core.audit. Users,
+    passwords and shares are plain ids so events outlive what they refer to
+    and a buffered batch never fails on a deleted row.
+    """
+    actions = (
+        ('reveal', 'reveal'),
+        ('shared_access', 'shared_access'),
+        ('share_create', 'share_create'),
+        ('share_update', 'share_update'),
+        ('share_delete', 'share_delete'),
+        ('share_grant', 'share_grant'),
+        ('share_revoke', 'share_revoke'),
+    )
+    action = models.CharField(max_length=20, choices=actions)
+    user_id = models.BigIntegerField(null=True, blank=True)
+    password_id = models.BigIntegerField(null=True, blank=True)
+    share_id = models.BigIntegerField(null=True, blank=True)
+    target_user_id = models.BigIntegerField(null=True, blank=True)
+    detail = models.CharField(max_length=255, blank=True)
+    remote_addr = models.GenericIPAddressField(null=True, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'created_at']),
+            models.Index(fields=['password_id', 'created_at']),
+        ]
@@ -0,0 +1,50 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PasswordCursorPagination(CursorPagination):
+    """
+    Keyset pagination for passwords, ordered on id or date. A view may
+    set cursor_ordering to change the default.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-id'
+    ordering_query_param = 'ordering'
+    ordering_fields = ('id', '-id', 'date', '-date', 'expired_at', '-expired_at')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if ordering not in self.ordering_fields:
+            ordering = getattr(view, 'cursor_ordering', self.ordering)
+        # Only id is unique, tie-break on it to keep the cursor stable
+        if ordering.lstrip('-') != 'id':
+            return (ordering, ordering.replace(ordering.lstrip('-'), 'id'))
+        return (ordering,)
+
+
+class SearchCursorPagination(CursorPagination):
+    """
+    Keyset pagination for ?search= results. Listings without a search
+    term keep returning the whole collection as before.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not request.query_params.get('search', '').strip():
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class AuditCursorPagination(CursorPagination):
+    """
+    Newest audit events first, tie-broken on id since events recorded in
+    the same instant share created_at.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('-created_at', '-id')
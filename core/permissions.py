@@ -1,4 +1,16 @@
-from rest_framework.permissions import DjangoModelPermissions
+from django.conf import settings
+from rest_framework.permissions import BasePermission, DjangoModelPermissions
+
+
+class IsInternalOrAdmin(BasePermission):
+    """
+    Allows staff users and requests from settings.INTERNAL_IPS, empty unless configured
+    """
+    def has_permission(self, request, view):
+        if request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS:
+            return True
+        return bool(request.user and request.user.is_staff)
+
 
 class ShareModelPermissions(DjangoModelPermissions):
 
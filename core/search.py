@@ -0,0 +1,123 @@
+"""
+Substring search over password titles, organization names and users.
+
+On SQLite every searched table gets an FTS5 trigram index, an external
+content table kept in sync by triggers. On PostgreSQL the same columns get
+pg_trgm GIN indexes, which serve Django's icontains lookups. install()
+creates whatever is missing and runs after every migrate, because SQLite
+migrations that rebuild a table drop its triggers.
+"""
+import logging
+from functools import lru_cache
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.db.models import Q
+from rest_framework.filters import BaseFilterBackend
+
+# name -> (table, columns)
+INDEXES = {
+    'password': ('core_password', ('title',)),
+    'organization': ('core_organization', ('name',)),
+    'user': ('core_user', ('email', 'first_name', 'last_name')),
+}
+
+# Trigrams cannot match shorter terms, those fall back to a prefix match
+MIN_SUBSTRING_LENGTH = 3
+
+
+def sqlite_statements(table, columns):
+    search_table = '%s_search' % table
+    values = ', '.join('new.%s' % column for column in columns)
+    old_values = ', '.join('old.%s' % column for column in columns)
+    column_list = ', '.join(columns)
+    delete = ("INSERT INTO {search}({search}, rowid, {columns}) VALUES ('delete', old.id, {old});"
+              .format(search=search_table, columns=column_list, old=old_values))
+    insert = ('INSERT INTO {search}(rowid, {columns}) VALUES (new.id, {new});'
+              .format(search=search_table, columns=column_list, new=values))
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {search} USING fts5({columns}, content='{table}', "
+        "content_rowid='id', tokenize='trigram')".format(search=search_table, columns=column_list, table=table),
+        'CREATE TRIGGER IF NOT EXISTS {search}_insert AFTER INSERT ON {table} BEGIN {insert} END'.format(
+            search=search_table, table=table, insert=insert),
+        'CREATE TRIGGER IF NOT EXISTS {search}_delete AFTER DELETE ON {table} BEGIN {delete} END'.format(
+            search=search_table, table=table, delete=delete),
+        'CREATE TRIGGER IF NOT EXISTS {search}_update AFTER UPDATE OF {columns} ON {table} BEGIN {delete} {insert} END'
+        .format(search=search_table, table=table, columns=column_list, delete=delete, insert=insert),
+    ]
+
+
+def postgresql_statements(table, columns):
+    return ['CREATE EXTENSION IF NOT EXISTS pg_trgm'] + [
+        'CREATE INDEX IF NOT EXISTS {table}_{column}_trgm ON {table} USING gin (UPPER("{column}"::text) gin_trgm_ops)'
+        .format(table=table, column=column)
+        for column in columns
+    ]
+
+
+def install(using=connection):
+    """
+    Create the search indexes that are missing. SQLite indexes whose
+    triggers had to be recreated are rebuilt from their table.
+    """
+    with using.cursor() as cursor:
+        for name, (table, columns) in INDEXES.items():
+            if using.vendor == 'postgresql':
+                for statement in postgresql_statements(table, columns):
+                    cursor.execute(statement)
+            elif using.vendor == 'sqlite':
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [table])
+                triggers = {row[0] for row in cursor.fetchall()}
+                try:
+                    for statement in sqlite_statements(table, columns):
+                        cursor.execute(statement)
+                except Exception:
+                    # SQLite older than 3.34 has no trigram tokenizer, search falls back to LIKE
+                    logging.getLogger('error_logger').warning('FTS5 trigram search is not available on %s', table)
+                    break
+                if len(triggers & {'%s_search_%s' % (table, event) for event in ('insert', 'delete', 'update')}) < 3:
+                    cursor.execute("INSERT INTO {search}({search}) VALUES ('rebuild')".format(search=table + '_search'))
+    has_fts.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def has_fts(table):
+    if connection.vendor != 'sqlite':
+        return False
+    return table + '_search' in connection.introspection.table_names()
+
+
+def search(queryset, name, term):
+    """
+    Filter the queryset to rows whose indexed columns contain the term.
+    """
+    table, columns = INDEXES[name]
+    term = term.strip()
+    if len(term) < MIN_SUBSTRING_LENGTH:
+        query = Q()
+        for column in columns:
+            query |= Q(**{column + '__istartswith': term})
+        return queryset.filter(query)
+    if has_fts(table):
+        # A quoted FTS5 string is matched as a substring by the trigram tokenizer
+        match = '"%s"' % term.replace('"', '""')
+        return queryset.filter(id__in=RawSQL(
+            'SELECT rowid FROM {search} WHERE {search} MATCH %s'.format(search=table + '_search'), [match]))
+    query = Q()
+    for column in columns:
+        query |= Q(**{column + '__icontains': term})
+    return queryset.filter(query)
+
+
+class IndexedSearchFilter(BaseFilterBackend):
+    """
+    ?search= on the view's search_index, applied to its own queryset so
+    results stay limited to what the view would list.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '')
+        if not term.strip():
+            return queryset
+        return search(queryset, view.search_index, term)
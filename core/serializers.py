@@ -1,17 +1,35 @@
 from datetime import timedelta
-import re
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from django.contrib.auth.password_validation import validate_password
-from .models import User, Password, Organization, Share
+from .models import User, Password, Organization, Share, AuditEvent
 from django.contrib.auth.hashers import (
     make_password,
 )
-from .util import encrypt, decrypt
+from .util import encrypt, decrypt, decrypt_many, fingerprint, password_strength
 from django.utils import timezone
 from django.contrib.auth.models import Permission
 from django.conf import settings
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer as BaseTokenObtainPairSerializer,
+    TokenRefreshSerializer as BaseTokenRefreshSerializer,
+)
+from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import add_user_claims, is_revoked
+from .instrumentation import timed
+from . import audit
+
+
+class TimedSerializerMixin:
+    """
+    Counts to_representation as serializer time in instrumented requests
+    """
+    @timed('serializer')
+    def to_representation(self, instance):
+        return super().to_representation(instance)
 
-class RegisterSerializer(serializers.ModelSerializer):
+class RegisterSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
     confirmpswd = serializers.CharField(write_only=True, required=True)
@@ -37,24 +55,54 @@ class RegisterSerializer(serializers.ModelSerializer):
             last_name = validated_data['last_name'],
         )
 
-        user.set_password(validated_data['password'])
+        with timed('hashing'):
+            user.set_password(validated_data['password'])
         user.save()
         
         return user
 
 
-class PasswordSerializer(serializers.ModelSerializer):
+class PasswordListSerializer(serializers.ListSerializer):
+    """
+    Decrypts a whole page in one batch before the rows are serialized
+    """
+    def to_representation(self, data):
+        data = list(data.all() if hasattr(data, 'all') else data)
+        if 'decrypt_password' in self.child.fields:
+            cipher_texts = [obj.cipher_text for obj in data if obj.cipher_text not in self.child._plaintexts]
+            self.child._plaintexts.update(zip(cipher_texts, decrypt_many(cipher_texts)))
+        return super().to_representation(data)
+
+
+class PasswordSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializes a Password register object
     """
     password = serializers.CharField(write_only=True, validators=[validate_password])
     decrypt_password = serializers.SerializerMethodField(read_only=True)
-    strength = serializers.SerializerMethodField(read_only=True)
+    strength = serializers.CharField(read_only=True)
     status = serializers.SerializerMethodField(read_only=True)
     class Meta:
         model = Password
         fields = ('id', 'title', 'password', 'date', 'decrypt_password', 'strength', 
                   'duration_in_days', 'expired_at', 'status', 'created_by')
+        list_serializer_class = PasswordListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._plaintexts = {}
+
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        # ?fields=id,title limits the response, ?include_secret=false skips decryption
+        fields = request.query_params.get('fields')
+        if fields:
+            allowed = set(fields.split(','))
+            for field_name in set(self.fields) - allowed:
+                self.fields.pop(field_name)
+        if request.query_params.get('include_secret', '').lower() in ('false', '0', 'no'):
+            self.fields.pop('decrypt_password', None)
 
     def create(self, validated_data):
         """
@@ -62,7 +110,9 @@ class PasswordSerializer(serializers.ModelSerializer):
         """
         password = Password.objects.create(
             title=validated_data['title'],
-            password=encrypt(validated_data['password']),
+            cipher_text=encrypt(validated_data['password']),
+            strength=password_strength(validated_data['password']),
+            fingerprint=fingerprint(validated_data['password']),
             duration_in_days=validated_data['duration_in_days'],
             expired_at=timezone.now() + timedelta(days=validated_data['duration_in_days']),
             created_by=self.context['request'].user
@@ -74,45 +124,74 @@ class PasswordSerializer(serializers.ModelSerializer):
         """Handle updating password model"""
         if 'password' in validated_data:
             password = validated_data.pop('password')
-            instance.password = encrypt(password)
+            instance.cipher_text = encrypt(password)
+            instance.strength = password_strength(password)
+            instance.fingerprint = fingerprint(password)
         if 'duration_in_days' in validated_data:
             instance.expired_at = instance.date + timedelta(days=validated_data['duration_in_days'])
+            instance.expiry_notified_at = None
 
         return super().update(instance, validated_data)
     
+    def get_plaintext(self, obj):
+        """
+        Decrypt obj.cipher_text at most once per serializer.
+        """
+        cipher_text = obj.cipher_text
+        if cipher_text not in self._plaintexts:
+            self._plaintexts[cipher_text] = decrypt(cipher_text)
+        return self._plaintexts[cipher_text]
+
     def get_decrypt_password(self, obj):
-        return decrypt(obj.password)
-    
-    def get_strength(self, obj):
-        if(bool(re.match('((?=.*\d)(?=.*[a-z])(?=.*[A-Z])(?=.*[!@#$%^&*]).{8,30})',decrypt(obj.password)))==True):
-            return "Strong"
-        elif(bool(re.match('((\d*)([a-z]*)([A-Z]*)([!@#$%^&*]*).{8,30})',decrypt(obj.password)))==True):
-            return "Weak"
+        request = self.context.get('request')
+        if request is not None:
+            audit.record('reveal', request.user, password_id=obj.id, request=request)
+        return self.get_plaintext(obj)
     
     def get_status(self, obj):
+        if hasattr(obj, 'expiry_status'):
+            return obj.expiry_status
         return 'Expired' if obj.expired_at <= timezone.now() else 'Not expired'
 
-class  OrganizationSerializer(serializers.ModelSerializer):
+class PasswordImportSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Validates one row of a bulk import, title uniqueness is checked per batch
+    """
+    title = serializers.CharField(max_length=128)
+    password = serializers.CharField(write_only=True, validators=[validate_password])
+
+    class Meta:
+        model = Password
+        fields = ('title', 'password', 'duration_in_days')
+
+
+class OrganizationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     users = serializers.SerializerMethodField(read_only=True)
     class Meta:
         model = Organization
         fields = '__all__'
     
     def get_users(self, obj):
-        return User.objects.values_list('id', flat=True).filter(organizations=obj).distinct()
+        return [user.id for user in obj.user_set.all()]
 
 
-class  ShareSerializer(serializers.ModelSerializer):
+class ShareSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     url = serializers.SerializerMethodField(read_only=True)
     class Meta:
         model = Share
         fields = '__all__'
     
     def get_url(self, obj):
-        return '%s/api/shared_passwords/%s/' % (settings.BASE_URL, obj.password.id)
+        return '%s/api/shared_passwords/%s/' % (settings.BASE_URL, obj.password_id)
 
 
-class  PermissionSerializer(serializers.ModelSerializer):
+class AuditEventSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = AuditEvent
+        fields = '__all__'
+
+
+class PermissionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     content_type_name = serializers.SerializerMethodField('get_content_type_name', read_only=True)
 
     class Meta:
@@ -121,3 +200,29 @@ class  PermissionSerializer(serializers.ModelSerializer):
 
     def get_content_type_name(self, obj):
         return obj.content_type.name
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    """
+    Embeds the claims used by StatelessJWTAuthentication
+    """
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    """
+    Refuses revoked refresh tokens and re-reads the claims so profile and
+    staff changes reach new access tokens.
+    """
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        if is_revoked(refresh):
+            raise InvalidToken('Token has been revoked')
+        try:
+            user = User.objects.get(id=refresh['user_id'], is_active=True)
+        except User.DoesNotExist:
+            raise InvalidToken('User not found')
+        add_user_claims(refresh, user)
+        return {'access': str(refresh.access_token)}
@@ -0,0 +1,270 @@
+import logging
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver, Signal
+from django.utils import timezone
+
+from . import access, search, sync
+from .caching import bump_version
+from .models import Organization, Password, Share, User, share_permissions_cache_key
+
+# Sent by sweep_expired_passwords with a batch of newly expired passwords
+passwords_expired = Signal()
+
+
+@receiver(m2m_changed, sender=Share.permissions.through)
+def share_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            cache.delete(share_permissions_cache_key(instance.user_id, instance.password_id))
+        return
+
+    # Changed from the Permission side, instance is a Permission and pk_set holds share ids
+    if action == 'pre_clear':
+        shares = Share.objects.filter(permissions=instance)
+    elif action in ('post_add', 'post_remove'):
+        shares = Share.objects.filter(id__in=pk_set)
+    else:
+        return
+    cache.delete_many([
+        share_permissions_cache_key(user_id, password_id)
+        for user_id, password_id in shares.values_list('user_id', 'password_id')
+    ])
+
+
+@receiver(post_save, sender=Share)
+@receiver(post_delete, sender=Share)
+def share_changed(sender, instance, **kwargs):
+    # A re-pointed share also changes what its previous user had on its previous password
+    cache.delete_many([share_permissions_cache_key(user_id, password_id)
+                       for user_id, password_id in share_pairs(instance)])
+
+
+@receiver(passwords_expired)
+def log_expired_passwords(sender, passwords, **kwargs):
+    logger = logging.getLogger('password_expiry')
+    for password in passwords:
+        logger.info('Password %s (%s) expired at %s', password.id, password.title, password.expired_at)
+
+
+@receiver(post_migrate)
+def invalidate_lookups(sender, **kwargs):
+    bump_version()
+
+
+@receiver(post_migrate)
+def install_search_indexes(sender, using, **kwargs):
+    # Once per migrate, not once per migrated app
+    if sender.name == 'core':
+        search.install(connections[using])
+
+
+@receiver(m2m_changed, sender=User.organizations.through)
+@receiver(m2m_changed, sender=Organization.passwords.through)
+def touch_organizations(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Membership and password changes alter how an organization is
+    represented, so move its updated_at (and with it its ETag).
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if isinstance(instance, Organization):
+        organization_ids = [instance.pk]
+    elif action == 'pre_clear':
+        related = instance.organizations if isinstance(instance, User) else instance.organization_passwords
+        organization_ids = list(related.values_list('id', flat=True))
+    else:
+        organization_ids = pk_set
+    Organization.objects.filter(id__in=organization_ids).update(updated_at=timezone.now())
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Password)
+def touch_organizations_on_delete(sender, instance, **kwargs):
+    # Deleting a member or password removes its through rows without m2m_changed
+    related = instance.organizations if isinstance(instance, User) else instance.organization_passwords
+    related.update(updated_at=timezone.now())
+
+
+# Change log for /api/sync/
+
+@receiver(post_save, sender=Password)
+@receiver(post_save, sender=Organization)
+@receiver(post_save, sender=Share)
+def log_saved(sender, instance, **kwargs):
+    sync.record(sender._meta.model_name, [instance.pk])
+
+
+@receiver(post_delete, sender=Password)
+@receiver(post_delete, sender=Organization)
+@receiver(post_delete, sender=Share)
+def log_deleted(sender, instance, **kwargs):
+    sync.record(sender._meta.model_name, [instance.pk], action='delete')
+
+
+@receiver(post_save, sender=Share)
+@receiver(post_delete, sender=Share)
+def log_share_access(sender, instance, origin=None, **kwargs):
+    # A deleted user has nothing left to sync, and its entries would point at a missing row
+    if isinstance(origin, User):
+        return
+    # A re-pointed share also takes the password away from its previous user
+    sync.record_access('password', share_pairs(instance))
+
+
+@receiver(m2m_changed, sender=Share.permissions.through)
+def log_share_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        shares = Share.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        shares = Share.objects.filter(permissions=instance)
+    else:
+        shares = Share.objects.filter(id__in=pk_set)
+    shares = list(shares.values_list('id', 'user_id', 'password_id'))
+    sync.record('share', [share_id for share_id, _, _ in shares])
+    # view_password decides whether the recipient sees the password at all
+    sync.record_access('password', [(user_id, password_id) for _, user_id, password_id in shares])
+
+
+@receiver(m2m_changed, sender=User.organizations.through)
+@receiver(m2m_changed, sender=Organization.passwords.through)
+def log_organization_access(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Organization membership and passwords decide who sees which password,
+    log the affected passwords for every affected member.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if isinstance(instance, Organization):
+        organization_ids = [instance.pk]
+    elif action == 'pre_clear':
+        related = instance.organizations if isinstance(instance, User) else instance.organization_passwords
+        organization_ids = list(related.values_list('id', flat=True))
+    else:
+        organization_ids = pk_set
+    sync.record('organization', organization_ids)
+
+    if sender is User.organizations.through:
+        user_ids = [instance.pk] if isinstance(instance, User) else (
+            pk_set if pk_set is not None else list(instance.user_set.values_list('id', flat=True)))
+        password_ids = Organization.passwords.through.objects.filter(
+            organization_id__in=organization_ids).values_list('password_id', flat=True)
+    else:
+        password_ids = [instance.pk] if isinstance(instance, Password) else (
+            pk_set if pk_set is not None else list(instance.passwords.values_list('id', flat=True)))
+        user_ids = User.organizations.through.objects.filter(
+            organization_id__in=organization_ids).values_list('user_id', flat=True)
+    sync.record('password', set(password_ids), user_ids=set(user_ids))
+
+
+# Materialized access, see core.access
+
+@receiver(pre_save, sender=Share)
+def remember_share_pair(sender, instance, **kwargs):
+    """
+    Keep the (user, password) pair an updated share moves away from, so the
+    post_save receivers can clean up after it too.
+    """
+    previous = None
+    if not instance._state.adding and instance.pk is not None:
+        previous = Share.objects.filter(pk=instance.pk).values_list('user_id', 'password_id').first()
+    instance._previous_pair = previous if previous != (instance.user_id, instance.password_id) else None
+
+
+def share_pairs(instance):
+    """
+    The share's (user, password) pair, preceded by the pair it was moved from.
+    """
+    previous = getattr(instance, '_previous_pair', None)
+    return ([previous] if previous else []) + [(instance.user_id, instance.password_id)]
+
+
+@receiver(post_save, sender=Password)
+def password_access_changed(sender, instance, created, update_fields, **kwargs):
+    if created or update_fields is None or 'created_by' in update_fields:
+        access.refresh(password_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Share)
+@receiver(post_delete, sender=Share)
+def share_access_changed(sender, instance, origin=None, **kwargs):
+    # Deleting a user or password cascades to its shares and its access rows alike
+    if isinstance(origin, (User, Password)):
+        return
+    with access.deferred():
+        for user_id, password_id in share_pairs(instance):
+            access.refresh([user_id], [password_id])
+
+
+@receiver(m2m_changed, sender=Share.permissions.through)
+def share_permissions_access_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            access.refresh([instance.user_id], [instance.password_id])
+        return
+
+    # Changed from the Permission side, the shares of a clear are gone by post_clear
+    if action == 'pre_clear':
+        instance._access_scope = list(Share.objects.filter(permissions=instance).values_list('user_id', 'password_id'))
+        return
+    if action in ('post_add', 'post_remove'):
+        pairs = list(Share.objects.filter(id__in=pk_set).values_list('user_id', 'password_id'))
+    elif action == 'post_clear':
+        pairs = instance.__dict__.pop('_access_scope', [])
+    else:
+        return
+    with access.deferred():
+        for user_id, password_id in pairs:
+            access.refresh([user_id], [password_id])
+
+
+@receiver(m2m_changed, sender=User.organizations.through)
+@receiver(m2m_changed, sender=Organization.passwords.through)
+def organization_access_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Refresh the members of the organizations involved against their
+    passwords. A clear is scoped before it runs.
+    """
+    if action == 'pre_clear':
+        if isinstance(instance, Organization):
+            instance._access_scope = access.organization_scope([instance.pk])
+        else:
+            related = instance.organizations if isinstance(instance, User) else instance.organization_passwords
+            user_ids, password_ids = access.organization_scope(list(related.values_list('id', flat=True)))
+            instance._access_scope = ([instance.pk], password_ids) if isinstance(instance, User) else (
+                user_ids, [instance.pk])
+        return
+    if action == 'post_clear':
+        access.refresh(*instance.__dict__.pop('_access_scope', ([], [])))
+        return
+    if action not in ('post_add', 'post_remove'):
+        return
+
+    if isinstance(instance, Organization):
+        user_ids, password_ids = access.organization_scope([instance.pk])
+        if sender is User.organizations.through:
+            user_ids = pk_set
+        else:
+            password_ids = pk_set
+    else:
+        user_ids, password_ids = access.organization_scope(pk_set)
+        if isinstance(instance, User):
+            user_ids = [instance.pk]
+        else:
+            password_ids = [instance.pk]
+    access.refresh(user_ids, password_ids)
+
+
+@receiver(pre_delete, sender=Organization)
+def organization_deleting(sender, instance, **kwargs):
+    # The membership and password rows are deleted without m2m_changed
+    instance._access_scope = access.organization_scope([instance.pk])
+
+
+@receiver(post_delete, sender=Organization)
+def organization_deleted(sender, instance, **kwargs):
+    access.refresh(*instance.__dict__.pop('_access_scope', ([], [])))
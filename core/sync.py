@@ -0,0 +1,93 @@
+"""
+Change log behind the /api/sync/ replication feed.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.utils import timezone
+
+from .models import ChangeLog, Organization, Password, Share, User
+from .serializers import PasswordSerializer, OrganizationSerializer, ShareSerializer
+
+
+def record(model, object_ids, action='upsert', user_ids=(None,)):
+    """
+    Append one entry per object and user, user None meaning everyone.
+    """
+    ChangeLog.objects.bulk_create([
+        ChangeLog(model=model, object_id=object_id, action=action, user_id=user_id)
+        for object_id in object_ids
+        for user_id in user_ids
+    ])
+
+
+def record_access(model, pairs):
+    """
+    Append one entry per (user, object) pair that gained or lost access.
+    """
+    ChangeLog.objects.bulk_create([
+        ChangeLog(model=model, object_id=object_id, user_id=user_id) for user_id, object_id in pairs
+    ])
+
+
+def feed(user, since, limit, context):
+    """
+    The entries after the since cursor that concern the user, reduced to
+    the current state of each object. Returns (cursor, has_more, upserts, deletes).
+    """
+    # Entries younger than SYNC_SETTLE_SECONDS may still have uncommitted predecessors
+    settled = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    entries = list(ChangeLog.objects.filter(
+        Q(user__isnull=True) | Q(user=user), id__gt=since, created_at__lte=settled,
+    ).order_by('id')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    cursor = entries[-1].id if entries else since
+
+    # Objects that were deleted, or that this user lost or gained access to
+    ids = {'password': set(), 'organization': set(), 'share': set()}
+    removable = set()
+    for entry in entries:
+        ids[entry.model].add(entry.object_id)
+        if entry.action == 'delete' or entry.user_id is not None:
+            removable.add((entry.model, entry.object_id))
+
+    passwords = Password.objects.visible_to(user).with_status().filter(id__in=ids['password'])
+    organizations = Organization.objects.filter(id__in=ids['organization']).prefetch_related(
+        Prefetch('user_set', queryset=User.objects.only('id')),
+        Prefetch('passwords', queryset=Password.objects.only('id')),
+    )
+    shares = Share.objects.filter(id__in=ids['share']).prefetch_related('permissions')
+    found = {
+        'password': list(passwords) if ids['password'] else [],
+        'organization': list(organizations) if ids['organization'] else [],
+        'share': list(shares) if ids['share'] else [],
+    }
+
+    upserts = {
+        'passwords': PasswordSerializer(found['password'], many=True, context=context).data,
+        'organizations': OrganizationSerializer(found['organization'], many=True, context=context).data,
+        'shares': ShareSerializer(found['share'], many=True, context=context).data,
+    }
+    deletes = {'passwords': [], 'organizations': [], 'shares': []}
+    for model, objects in found.items():
+        present = {obj.id for obj in objects}
+        for object_id in sorted(ids[model] - present):
+            # Not visible: report it if it is gone or this user lost access
+            if (model, object_id) in removable:
+                deletes[model + 's'].append(object_id)
+    return cursor, has_more, upserts, deletes
+
+
+def compact():
+    """
+    Drop entries superseded by a newer entry for the same object and
+    audience. The feed still converges to the same state.
+    """
+    newer = ChangeLog.objects.filter(model=OuterRef('model'), object_id=OuterRef('object_id'), id__gt=OuterRef('id'))
+    deleted, _ = ChangeLog.objects.filter(user__isnull=True).filter(
+        Exists(newer.filter(user__isnull=True))).delete()
+    deleted_targeted, _ = ChangeLog.objects.filter(user__isnull=False).filter(
+        Exists(newer.filter(user=OuterRef('user')))).delete()
+    return deleted + deleted_targeted
@@ -1,3 +1,1128 @@
-from django.test import TestCase
+from datetime import timedelta
+import hashlib
+import hmac
+import json
+from io import StringIO
+from urllib.parse import urlsplit
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.contrib.auth.models import Permission
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from cryptography.fernet import Fernet
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken
+from django.urls import resolve
+from django.utils import timezone
+
+from . import access, audit, benchmarks, search, sync, urls
+from .authentication import StatelessJWTAuthentication
+from .caching import bump_version
+from .models import Password, User, Organization, Share, ChangeLog, PasswordAccess, AuditEvent
+from .serializers import PasswordSerializer
+from .instrumentation import registry, timed
+from .signals import passwords_expired
+from .util import encrypt, decrypt, encrypt_many, decrypt_many, fingerprint, get_cipher, password_strength, rotate
+
+
+class PasswordSerializerDecryptTests(TestCase):
+
+    def make_passwords(self, count):
+        now = timezone.now()
+        return [
+            Password(id=i, title='title-%s' % i, cipher_text=encrypt('Secret#%s0rd' % i),
+                     date=now, duration_in_days=30, expired_at=now + timedelta(days=30))
+            for i in range(count)
+        ]
+
+    def test_decrypts_each_row_once(self):
+        passwords = self.make_passwords(5)
+        with mock.patch('core.util.decrypt', side_effect=decrypt) as patched:
+            data = PasswordSerializer(passwords, many=True).data
+        self.assertEqual(patched.call_count, 5)
+        self.assertEqual(data[0]['decrypt_password'], 'Secret#00rd')
+
+    def test_cipher_is_reused(self):
+        self.assertIs(get_cipher(), get_cipher())
+
+    @override_settings(CRYPTO_BATCH_THRESHOLD=1)
+    def test_batch_crypto_preserves_order_and_errors(self):
+        values = ['value-%s' % i for i in range(10)]
+        cipher_texts = encrypt_many(values, workers=3)
+        self.assertEqual(decrypt_many(cipher_texts, workers=3), values)
+        cipher_texts[4] = 'invalid'
+        with self.assertLogs('error_logger'):
+            result = decrypt_many(cipher_texts, workers=3)
+        self.assertIsNone(result[4])
+        self.assertEqual(result[5], 'value-5')
+
+
+class PasswordStrengthTests(TestCase):
+
+    def test_password_strength(self):
+        self.assertEqual(password_strength('Secret#00rd'), 'Strong')
+        self.assertEqual(password_strength('weakpassword'), 'Weak')
+        self.assertIsNone(password_strength('short'))
+        self.assertIsNone(password_strength(None))
+
+    def test_backfill_command(self):
+        for i, plaintext in enumerate(['Secret#00rd', 'weakpassword', 'Other#11rd']):
+            Password.objects.create(title='title-%s' % i, cipher_text=encrypt(plaintext), duration_in_days=30)
+        call_command('backfill_password_strength', batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            list(Password.objects.order_by('id').values_list('strength', flat=True)),
+            ['Strong', 'Weak', 'Strong'])
+
+
+class PasswordListTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', password='x')
+        for i in range(5):
+            Password.objects.create(title='title-%s' % i, cipher_text=encrypt('Secret#%s0rd' % i),
+                                    duration_in_days=30, expired_at=timezone.now() + timedelta(days=30),
+                                    created_by=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_cursor_pagination(self):
+        response = self.client.get('/api/passwords/', {'page_size': 2, 'ordering': 'id'})
+        self.assertEqual([row['title'] for row in response.data['results']], ['title-0', 'title-1'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['title'] for row in response.data['results']], ['title-2', 'title-3'])
+
+    def test_list_without_secret_skips_decryption(self):
+        with mock.patch('core.util.decrypt') as patched:
+            response = self.client.get('/api/passwords/', {'include_secret': 'false'})
+        self.assertEqual(patched.call_count, 0)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertNotIn('decrypt_password', response.data['results'][0])
+
+    def test_fields(self):
+        response = self.client.get('/api/passwords/', {'fields': 'id,title'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+
+
+class PasswordVisibilityTests(TestCase):
+
+    def setUp(self):
+        audit.buffer.clear()
+        self.user = User.objects.create_user(email='member@example.com', password='x')
+        other = User.objects.create_user(email='other@example.com', password='x')
+        self.own, self.org_password, self.shared, self.hidden = [
+            Password.objects.create(title=title, cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                    created_by=self.user if title == 'own' else other)
+            for title in ('own', 'org', 'shared', 'hidden')
+        ]
+        organization = Organization.objects.create(name='org', organizationId='org')
+        organization.passwords.add(self.org_password)
+        self.user.organizations.add(organization)
+        Share.objects.create(user=self.user, password=self.shared).permissions.add(
+            Permission.objects.get(codename='view_password'))
+
+    def test_visible_to(self):
+        with self.assertNumQueries(1):
+            visible = set(Password.objects.visible_to(self.user))
+        self.assertEqual(visible, {self.own, self.org_password, self.shared})
+        # A share without view_password does not reveal the password, write access needs its own permission
+        Share.objects.create(user=self.user, password=self.hidden)
+        self.assertNotIn(self.hidden, Password.objects.visible_to(self.user))
+        self.assertEqual(set(Password.objects.visible_to(self.user, 'change_password')),
+                         {self.own, self.org_password})
+
+    def test_visible_to_uses_indexes(self):
+        plan = Password.objects.visible_to(self.user).explain()
+        if connection.vendor == 'sqlite':
+            # The access table is searched by user and passwords by primary key, nothing is scanned
+            self.assertNotIn(' SCAN ', plan)
+            self.assertIn('core_passwordaccess', plan)
+
+
+class SharePermissionTests(APITestCase):
+
+    def setUp(self):
+        audit.buffer.clear()
+        self.user = User.objects.create_user(email='viewer@example.com', password='x')
+        self.password = Password.objects.create(title='shared', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                                expired_at=timezone.now() + timedelta(days=30))
+        self.share = Share.objects.create(user=self.user, password=self.password)
+        self.view_perm = Permission.objects.get(codename='view_password')
+        self.change_perm = Permission.objects.get(codename='change_password')
+        self.share.permissions.add(self.view_perm)
+        self.addCleanup(cache.clear)
+
+    def test_permissions_resolved_in_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.user.has_perm_in_password(self.password.id, 'view_password'))
+            self.assertFalse(self.user.has_perm_in_password(self.password.id, 'change_password'))
+
+    def test_shared_password_view(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/shared_passwords/%s/' % self.password.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['decrypt_password'], 'weakpassword')
+        response = self.client.delete('/api/shared_passwords/%s/' % self.password.id)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/api/shared_passwords/0/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_password_endpoints_follow_share_permissions(self):
+        self.client.force_authenticate(self.user)
+        url = '/api/passwords/%s/' % self.password.id
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.patch(url, {'title': 'taken over'}).status_code, 404)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertTrue(Password.objects.filter(id=self.password.id, title='shared').exists())
+
+        self.share.permissions.add(self.change_perm)
+        self.assertEqual(self.client.patch(url, {'title': 'renamed'}).status_code, 200)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+
+        # Without view_password the share hides the password, its secret and its export
+        self.share.permissions.set([])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.get('/api/passwords/export/', {'include_secret': 'true'})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    @override_settings(SHARE_PERMISSIONS_CACHE_TIMEOUT=60)
+    def test_cache_invalidated_on_permission_change(self):
+        def permissions():
+            # A fresh instance per call stands in for a new request
+            return User(id=self.user.id).password_permissions(self.password.id)
+
+        self.assertEqual(permissions(), {'view_password'})
+        with self.assertNumQueries(0):
+            self.assertEqual(permissions(), {'view_password'})
+        self.share.permissions.add(self.change_perm)
+        self.assertEqual(permissions(), {'view_password', 'change_password'})
+        self.change_perm.share_permissions.clear()
+        self.assertEqual(permissions(), {'view_password'})
+
+        # Moving the share to another user empties the previous user's cached permissions
+        self.share.user = User.objects.create_user(email='next-viewer@example.com', password='x')
+        self.share.save()
+        self.assertEqual(permissions(), frozenset())
+
+
+class ListQueryCountTests(APITestCase):
+    """
+    Listing any endpoint in core.urls takes a constant number of queries.
+    """
+
+    def setUp(self):
+        # Start with an empty audit buffer so no full batch is written inside a counted block
+        audit.buffer.clear()
+        self.user = User.objects.create_user(email='admin@example.com', password='x')
+        view_perm = Permission.objects.get(codename='view_password')
+        for i in range(3):
+            self.seed(i, view_perm)
+        self.client.force_authenticate(self.user)
+
+    def seed(self, i, permission):
+        member = User.objects.create_user(email='member%s@example.com' % i, password='x')
+        password = Password.objects.create(title='title-%s' % i, cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                           expired_at=timezone.now() + timedelta(days=30), created_by=self.user)
+        organization = Organization.objects.create(name='org-%s' % i, organizationId='org-%s' % i)
+        organization.passwords.add(password)
+        member.organizations.add(organization)
+        self.user.organizations.add(organization)
+        share = Share.objects.create(user=member, password=password)
+        share.permissions.add(permission)
+
+    def assertListQueries(self, url, num):
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # Doubling the data must not change the query count
+        for i in range(3, 6):
+            self.seed(i, Permission.objects.get(codename='change_password'))
+        with self.assertNumQueries(num):
+            self.client.get(url)
+
+    def test_passwords(self):
+        # One aggregate for the ETag, one for the page
+        self.assertListQueries('/api/passwords/', 2)
+
+    def test_organizations(self):
+        self.assertListQueries('/api/organizations/', 4)
+
+    def test_shares(self):
+        self.assertListQueries('/api/shares/', 2)
+
+    def test_users(self):
+        self.assertListQueries('/api/users/', 1)
+
+    def test_permissions(self):
+        # Served from core.caching once built
+        self.client.get('/api/permissions/')
+        self.assertListQueries('/api/permissions/', 0)
+
+
+class BulkImportExportTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='importer@example.com', password='x')
+        self.client.force_authenticate(self.user)
+        Password.objects.create(title='existing', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                expired_at=timezone.now(), created_by=self.user)
+
+    def test_import_ndjson(self):
+        lines = [
+            {'title': 'one', 'password': 'Secret#00rd', 'duration_in_days': 30},
+            {'title': 'two', 'password': 'weakpassword', 'duration_in_days': 10},
+            {'title': 'existing', 'password': 'weakpassword', 'duration_in_days': 10},
+            {'title': 'one', 'password': 'weakpassword', 'duration_in_days': 10},
+            {'title': 'short', 'password': 'x', 'duration_in_days': 10},
+        ]
+        body = '\n'.join(json.dumps(line) for line in lines) + '\nnot json\n'
+        upload = SimpleUploadedFile('passwords.ndjson', body.encode())
+        response = self.client.post('/api/passwords/import/', {'file': upload})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4, 5, 6])
+        self.assertEqual(Password.objects.get(title='one').strength, 'Strong')
+        self.assertEqual(decrypt(Password.objects.get(title='two').cipher_text), 'weakpassword')
+
+    def test_import_csv(self):
+        body = 'title,password,duration_in_days\nthree,Secret#00rd,5\n'
+        upload = SimpleUploadedFile('passwords.csv', body.encode())
+        response = self.client.post('/api/passwords/import/', {'file': upload})
+        self.assertEqual(response.data, {'created': 1, 'errors': []})
+
+    def test_export(self):
+        response = self.client.get('/api/passwords/export/', {'include_secret': 'true'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['title'], row['password']) for row in rows], [('existing', 'weakpassword')])
+        response = self.client.get('/api/passwords/export/', {'output': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,password,date,duration_in_days,expired_at,strength')
+        self.assertEqual(len(lines), 2)
+
+
+class KeyRotationTests(TestCase):
+
+    def test_rotate_encrypt_key(self):
+        old_key, new_key = settings.ENCRYPT_KEY, Fernet.generate_key().decode()
+        ids = [Password.objects.create(title='title-%s' % i, cipher_text=encrypt('weakpassword%s' % i),
+                                       duration_in_days=30).id for i in range(3)]
+        with override_settings(ENCRYPT_KEY=new_key, ENCRYPT_OLD_KEYS=[old_key]):
+            self.assertEqual(decrypt(Password.objects.get(id=ids[0]).cipher_text), 'weakpassword0')
+            call_command('rotate_encrypt_key', batch_size=2, stdout=StringIO())
+        with override_settings(ENCRYPT_KEY=new_key, ENCRYPT_OLD_KEYS=[]):
+            self.assertEqual([decrypt(Password.objects.get(id=id).cipher_text) for id in ids],
+                             ['weakpassword0', 'weakpassword1', 'weakpassword2'])
+            # Fingerprints keyed from the new ENCRYPT_KEY still match a fresh one
+            self.assertEqual(Password.objects.get(id=ids[0]).fingerprint, fingerprint('weakpassword0'))
+
+
+class CipherBackendTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='cipher@example.com', password='x')
+
+    def test_compact_binary_format(self):
+        cipher_text = encrypt('Secret#0rd' * 20)
+        self.assertIsInstance(cipher_text, bytes)
+        self.assertEqual(len(cipher_text), 200 + get_cipher().overhead)
+        self.assertEqual(decrypt(cipher_text), 'Secret#0rd' * 20)
+        # The header is authenticated, a changed key id or byte does not decrypt
+        self.assertIsNone(decrypt(cipher_text[:-1] + bytes([cipher_text[-1] ^ 1])))
+        password = Password.objects.create(title='long', cipher_text=cipher_text, duration_in_days=30)
+        password.refresh_from_db()
+        self.assertEqual((password.password, decrypt(password.cipher_text)), ('', 'Secret#0rd' * 20))
+
+    def test_legacy_rows_readable_and_upgraded_on_write(self):
+        legacy = get_cipher('fernet').encrypt(b'weakpassword')
+        password = Password.objects.create(title='legacy', cipher_text=legacy, duration_in_days=30,
+                                           created_by=self.user)
+        # Written once by create, so already upgraded
+        self.assertIsNotNone(Password.objects.get(id=password.id).secret)
+
+        Password.objects.filter(id=password.id).update(password=legacy, secret=None)
+        self.client.force_login(self.user)
+        response = self.client.get('/api/passwords/%s/' % password.id)
+        self.assertEqual(response.json()['decrypt_password'], 'weakpassword')
+        self.assertIsNone(Password.objects.get(id=password.id).secret)
+
+        password = Password.objects.get(id=password.id)
+        password.title = 'renamed'
+        password.save(update_fields=['title'])
+        password = Password.objects.get(id=password.id)
+        self.assertEqual((password.password, decrypt(password.cipher_text)), ('', 'weakpassword'))
+
+    def test_fernet_backend(self):
+        with override_settings(ENCRYPT_BACKEND='fernet'):
+            cipher_text = encrypt('weakpassword')
+            self.assertIsInstance(cipher_text, str)
+            self.assertEqual(decrypt(cipher_text), 'weakpassword')
+        # Read back through the format, whatever backend is configured
+        self.assertEqual(decrypt(cipher_text), 'weakpassword')
+        self.assertIsInstance(rotate(cipher_text), bytes)
+
+
+class PasswordExpiryTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='expiry@example.com', password='x')
+        now = timezone.now()
+        for title, delta in (('expired', -1), ('soon', 3), ('later', 30)):
+            Password.objects.create(title=title, cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                    expired_at=now + timedelta(days=delta), created_by=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_status_annotated_in_sql(self):
+        statuses = dict(Password.objects.with_status().values_list('title', 'expiry_status'))
+        self.assertEqual(statuses, {'expired': 'Expired', 'soon': 'Not expired', 'later': 'Not expired'})
+
+    def test_expiring_endpoint(self):
+        response = self.client.get('/api/passwords/expiring/', {'within': '7d'})
+        self.assertEqual([row['title'] for row in response.data['results']], ['soon'])
+        response = self.client.get('/api/passwords/expiring/', {'within': '60'})
+        self.assertEqual([row['title'] for row in response.data['results']], ['soon', 'later'])
+        response = self.client.get('/api/passwords/expiring/', {'within': 'week'})
+        self.assertEqual(response.status_code, 400)
+        # Past the maximum window, and past what timedelta or datetime can hold
+        for within in ('3651d', '99999999d', '9' * 30 + 'm'):
+            response = self.client.get('/api/passwords/expiring/', {'within': within})
+            self.assertEqual(response.status_code, 400)
+
+    def test_sweep_notifies_once(self):
+        received = []
+        handler = lambda passwords, **kwargs: received.extend(password.title for password in passwords)
+        passwords_expired.connect(handler)
+        self.addCleanup(passwords_expired.disconnect, handler)
+        call_command('sweep_expired_passwords', stdout=StringIO())
+        call_command('sweep_expired_passwords', stdout=StringIO())
+        self.assertEqual(received, ['expired'])
+
+
+class BenchmarkTests(TestCase):
+
+    def test_seed_and_run(self):
+        sizes = benchmarks.seed(40)
+        self.assertEqual(Password.objects.count(), sizes['passwords'])
+        only = ['token', 'token_revoke', 'passwords_list', 'passwords_import', 'shares_list', 'shares_bulk',
+                'shares_bulk_revoke', 'audit_list']
+        results = benchmarks.run(requests_per_route=2, only=only)
+        self.assertEqual(set(results), set(only))
+
+    def test_routes_cover_urls(self):
+        benchmarks.seed(40)
+        route_list, _ = benchmarks.routes()
+        covered = {resolve(urlsplit(path(0) if callable(path) else path).path).url_name
+                   for _, _, path, *_ in route_list}
+        self.assertEqual(covered, {pattern.name for pattern in urls.urlpatterns})
+
+    def test_compare(self):
+        baseline = {'passwords_list': {'p95_ms': 10, 'queries': 2}}
+        self.assertEqual(benchmarks.compare({'passwords_list': {'p95_ms': 12, 'queries': 2}}, baseline, 0.25), [])
+        self.assertEqual(len(benchmarks.compare({'passwords_list': {'p95_ms': 13, 'queries': 3}}, baseline, 0.25)), 2)
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True)
+class InstrumentationTests(APITestCase):
+
+    def setUp(self):
+        registry.reset()
+        self.user = User.objects.create_user(email='timed@example.com', password='x')
+        Password.objects.create(title='timed', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                expired_at=timezone.now(), created_by=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/passwords/')
+        metrics = dict(part.split(';', 1)[0:2] for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(metrics), {'crypto', 'db', 'serializer', 'total'})
+        self.assertIn('desc="2 queries"', metrics['db'])
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/passwords/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        # The test client connects from 127.0.0.1, only trusted when configured
+        with self.settings(INTERNAL_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.json()['password-list']['queries']['count'], 1)
+        self.assertEqual(response.json()['password-list']['queries']['sum'], 2)
+
+    def test_timed_outside_request_is_noop(self):
+        with timed('crypto'):
+            encrypt('value')
+
+
+class StatelessJWTTests(APITestCase):
+
+    def setUp(self):
+        audit.buffer.clear()
+        self.user = User.objects.create_user(email='jwt@example.com', password='Benchmark#2022', first_name='J')
+        self.organization = Organization.objects.create(name='org', organizationId='jwt')
+        self.user.organizations.add(self.organization)
+        password = Password.objects.create(title='org', cipher_text=encrypt('weakpassword'), duration_in_days=30)
+        self.organization.passwords.add(password)
+        self.tokens = self.client.post('/api/token/', {'email': 'jwt@example.com', 'password': 'Benchmark#2022'}).data
+        self.addCleanup(cache.clear)
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/api/passwords/', HTTP_AUTHORIZATION='Bearer %s' % token)
+        return StatelessJWTAuthentication().authenticate(request)
+
+    def test_user_built_from_claims(self):
+        self.authenticate(self.tokens['access'])
+        with self.assertNumQueries(0):
+            user, token = self.authenticate(self.tokens['access'])
+        self.assertEqual((user.id, user.email, user.first_name), (self.user.id, 'jwt@example.com', 'J'))
+        self.assertEqual(list(Password.objects.visible_to(user)), list(Password.objects.visible_to(self.user)))
+        with self.assertRaises(NotImplementedError):
+            user.save()
+
+    def test_revoke(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % self.tokens['access'])
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        response = self.client.post('/api/token/revoke/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+        with self.assertRaises(InvalidToken):
+            self.authenticate(self.tokens['access'])
+        self.client.credentials()
+        response = self.client.post('/api/token/refresh/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh_updates_claims(self):
+        User.objects.filter(id=self.user.id).update(first_name='Jay', is_staff=True)
+        access = self.client.post('/api/token/refresh/', {'refresh': self.tokens['refresh']}).data['access']
+        user, token = self.authenticate(access)
+        self.assertEqual((user.first_name, user.is_staff), ('Jay', True))
+        self.assertNotIn('org_ids', token)
+
+
+class HealthTests(APITestCase):
+
+    def test_health(self):
+        response = self.client.get('/api/health/')
+        self.assertEqual(response.json()['database'], 'ok')
+
+
+class AsyncPasswordViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='async@example.com', password='x')
+        self.other = User.objects.create_user(email='async-other@example.com', password='x')
+        self.passwords = [
+            Password.objects.create(title='async-%s' % i, cipher_text=encrypt('weakpassword%s' % i),
+                                    duration_in_days=30, expired_at=timezone.now(), created_by=self.user)
+            for i in range(3)
+        ]
+        share = Share.objects.create(user=self.other, password=self.passwords[0])
+        share.permissions.add(Permission.objects.get(codename='view_password'))
+        self.headers = self.auth_headers(self.user)
+
+    def auth_headers(self, user):
+        # AsyncClient turns extra keyword arguments into plain header names
+        return {'AUTHORIZATION': 'Bearer %s' % AccessToken.for_user(user)}
+
+    async def test_list_and_detail(self):
+        response = await self.async_client.get('/api/async/passwords/', {'page_size': 2}, **self.headers)
+        data = response.json()
+        self.assertEqual([row['decrypt_password'] for row in data['results']], ['weakpassword0', 'weakpassword1'])
+        response = await self.async_client.get(data['next'], **self.headers)
+        self.assertEqual([row['title'] for row in response.json()['results']], ['async-2'])
+        self.assertIsNone(response.json()['next'])
+
+        response = await self.async_client.get('/api/async/passwords/%s/' % self.passwords[1].id, **self.headers)
+        self.assertEqual(response.json()['decrypt_password'], 'weakpassword1')
+
+    async def test_read_only(self):
+        for method in ('post', 'put', 'delete'):
+            response = await getattr(self.async_client, method)('/api/async/passwords/', **self.headers)
+            self.assertEqual(response.status_code, 405)
+        response = await self.async_client.delete('/api/async/shared_passwords/%s/' % self.passwords[0].id,
+                                                  **self.headers)
+        self.assertEqual(response.status_code, 405)
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get('/api/async/passwords/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_shared_password(self):
+        headers = self.auth_headers(self.other)
+        response = await self.async_client.get('/api/async/shared_passwords/%s/' % self.passwords[0].id, **headers)
+        self.assertEqual(response.json()['decrypt_password'], 'weakpassword0')
+        response = await self.async_client.get('/api/async/shared_passwords/%s/' % self.passwords[1].id, **headers)
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get('/api/async/shared_passwords/0/', **headers)
+        self.assertEqual(response.status_code, 404)
+
+
+class PermissionCatalogueTests(APITestCase):
+
+    def setUp(self):
+        audit.buffer.clear()
+        self.client.force_authenticate(User.objects.create_user(email='catalogue@example.com', password='x'))
+        self.addCleanup(cache.clear)
+
+    def test_cached_with_etag(self):
+        response = self.client.get('/api/permissions/')
+        codenames = {permission['codename'] for permission in response.json()}
+        self.assertEqual(codenames, {'add_password', 'change_password', 'delete_password', 'view_password'})
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/permissions/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalidated_by_migrate_signal(self):
+        etag = self.client.get('/api/permissions/')['ETag']
+        Permission.objects.filter(codename='add_password').update(name='Create password')
+        self.assertEqual(self.client.get('/api/permissions/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        bump_version()
+        response = self.client.get('/api/permissions/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Create password', {permission['name'] for permission in response.json()})
+
+
+class ConditionalRequestTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='etag@example.com', password='x')
+        self.password = Password.objects.create(title='etag', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                                expired_at=timezone.now() + timedelta(days=30), created_by=self.user)
+        self.organization = Organization.objects.create(name='org', organizationId='etag')
+        self.client.force_authenticate(self.user)
+
+    def test_password_collection_304_skips_decryption(self):
+        etag = self.client.get('/api/passwords/')['ETag']
+        with mock.patch('core.util.decrypt') as patched:
+            response = self.client.get('/api/passwords/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(patched.call_count, 0)
+
+        self.client.patch('/api/passwords/%s/' % self.password.id, {'duration_in_days': 10})
+        self.assertEqual(self.client.get('/api/passwords/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_password_resource(self):
+        url = '/api/passwords/%s/' % self.password.id
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Password.objects.filter(id=self.password.id).update(expired_at=timezone.now())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_changed_since(self):
+        since = timezone.now()
+        Password.objects.create(title='newer', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                expired_at=timezone.now(), created_by=self.user)
+        response = self.client.get('/api/passwords/', {'changed_since': since.isoformat()})
+        self.assertEqual([row['title'] for row in response.data['results']], ['newer'])
+        self.assertEqual(self.client.get('/api/passwords/', {'changed_since': 'yesterday'}).status_code, 400)
+
+    def test_organization_membership_changes_etag(self):
+        url = '/api/organizations/%s/' % self.organization.id
+        etag = self.client.get(url)['ETag']
+        collection_etag = self.client.get('/api/organizations/')['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.user.organizations.add(self.organization)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/organizations/', HTTP_IF_NONE_MATCH=collection_etag).status_code, 200)
+
+    def test_deletes_change_organization_etag(self):
+        self.organization.passwords.add(self.password)
+        member = User.objects.create_user(email='leaving@example.com', password='x')
+        member.organizations.add(self.organization)
+        for deleted in (self.password, member):
+            etag = self.client.get('/api/organizations/')['ETag']
+            deleted.delete()
+            self.assertEqual(self.client.get('/api/organizations/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncFeedTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='sync@example.com', password='x')
+        self.owner = User.objects.create_user(email='sync-owner@example.com', password='x')
+        self.organization = Organization.objects.create(name='org', organizationId='sync')
+        self.password = Password.objects.create(title='sync', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                                expired_at=timezone.now(), created_by=self.owner)
+        self.client.force_authenticate(self.user)
+
+    def sync(self, since=0):
+        return self.client.get('/api/sync/', {'since': since}).data
+
+    def test_gain_and_lose_access(self):
+        cursor = self.sync()['cursor']
+        self.organization.passwords.add(self.password)
+        self.user.organizations.add(self.organization)
+        data = self.sync(cursor)
+        self.assertEqual([row['id'] for row in data['upserts']['passwords']], [self.password.id])
+        self.assertEqual([row['id'] for row in data['upserts']['organizations']], [self.organization.id])
+
+        self.user.organizations.remove(self.organization)
+        data = self.sync(data['cursor'])
+        self.assertEqual(data['upserts']['passwords'], [])
+        self.assertEqual(data['deletes']['passwords'], [self.password.id])
+
+    def test_invisible_changes_are_not_sent(self):
+        cursor = self.sync()['cursor']
+        self.password.title = 'renamed'
+        self.password.save()
+        data = self.sync(cursor)
+        self.assertEqual((data['upserts']['passwords'], data['deletes']['passwords']), ([], []))
+
+    def test_share_and_delete(self):
+        cursor = self.sync()['cursor']
+        share = Share.objects.create(user=self.user, password=self.password)
+        share.permissions.add(Permission.objects.get(codename='view_password'))
+        data = self.sync(cursor)
+        self.assertEqual([row['id'] for row in data['upserts']['passwords']], [self.password.id])
+        self.assertEqual([row['id'] for row in data['upserts']['shares']], [share.id])
+        password_id = self.password.id
+        self.password.delete()
+        data = self.sync(data['cursor'])
+        self.assertEqual(data['deletes']['passwords'], [password_id])
+        self.assertEqual(data['deletes']['shares'], [share.id])
+
+    def test_share_moved_to_another_user(self):
+        share = Share.objects.create(user=self.user, password=self.password)
+        cursor = self.sync()['cursor']
+        share.user = self.owner
+        share.save()
+        data = self.sync(cursor)
+        self.assertEqual(data['deletes']['passwords'], [self.password.id])
+
+    def test_paging_and_compaction(self):
+        for i in range(3):
+            self.password.save()
+        data = self.client.get('/api/sync/', {'limit': 1}).data
+        self.assertTrue(data['has_more'])
+        for params in ({'limit': -5}, {'limit': 0}, {'limit': 'many'}, {'since': -1}):
+            self.assertEqual(self.client.get('/api/sync/', params).status_code, 400)
+        before = ChangeLog.objects.count()
+        self.assertEqual(sync.compact(), before - ChangeLog.objects.count())
+        self.assertEqual(ChangeLog.objects.filter(model='password', object_id=self.password.id,
+                                                  user__isnull=True).count(), 1)
+
+
+class OrganizationBulkTests(APITestCase):
+
+    def setUp(self):
+        audit.buffer.clear()
+        self.user = User.objects.create_user(email='bulk-admin@example.com', password='x')
+        self.organization = Organization.objects.create(name='org', organizationId='bulk')
+        self.members = [User.objects.create_user(email='bulk%s@example.com' % i, password='x') for i in range(3)]
+        self.members[0].organizations.add(self.organization)
+        self.user.organizations.add(self.organization)
+        self.passwords = [Password.objects.create(title='bulk%s' % i, cipher_text=encrypt('weakpassword'),
+                                                  duration_in_days=30, expired_at=timezone.now(),
+                                                  created_by=self.user) for i in range(2)]
+        self.client.force_authenticate(self.user)
+
+    def test_add_members(self):
+        cursor = ChangeLog.objects.order_by('-id').values_list('id', flat=True).first()
+        response = self.client.post('/api/organizations/%s/members/' % self.organization.id, {
+            'emails': ['BULK1@example.com', 'bulk0@example.com', 'nobody@example.com'],
+            'user_ids': [self.members[2].id, self.members[1].id],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['status'] for row in response.data['results']],
+                         ['added', 'already_member', 'not_found', 'added', 'already_member'])
+        self.assertEqual(set(self.organization.user_set.all()), set(self.members) | {self.user})
+        # The signal receivers still log the membership change
+        self.assertTrue(ChangeLog.objects.filter(id__gt=cursor, model='organization').exists())
+
+    def test_add_passwords(self):
+        with self.assertNumQueries(20):
+            response = self.client.post('/api/organizations/%s/passwords/' % self.organization.id, {
+                'passwords': [self.passwords[0].id, self.passwords[1].id, self.passwords[0].id, 0],
+            }, format='json')
+        self.assertEqual([row['status'] for row in response.data['results']],
+                         ['added', 'added', 'already_assigned', 'not_found'])
+        self.assertEqual(set(self.organization.passwords.all()), set(self.passwords))
+
+    def test_add_passwords_only_changeable(self):
+        other = Password.objects.create(title='other', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                        expired_at=timezone.now(), created_by=self.members[1])
+        shared = Password.objects.create(title='shared', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                         expired_at=timezone.now(), created_by=self.members[1])
+        share = Share.objects.create(user=self.user, password=shared)
+        share.permissions.add(Permission.objects.get(codename='view_password'))
+        body = {'passwords': [other.id, shared.id]}
+        response = self.client.post('/api/organizations/%s/passwords/' % self.organization.id, body, format='json')
+        self.assertEqual([row['status'] for row in response.data['results']], ['not_found', 'not_found'])
+
+        share.permissions.add(Permission.objects.get(codename='change_password'))
+        response = self.client.post('/api/organizations/%s/passwords/' % self.organization.id, body, format='json')
+        self.assertEqual([row['status'] for row in response.data['results']], ['not_found', 'added'])
+        self.assertEqual(list(self.organization.passwords.all()), [shared])
+
+    def test_members_only(self):
+        self.user.organizations.remove(self.organization)
+        response = self.client.post('/api/organizations/%s/members/' % self.organization.id,
+                                    {'user_ids': [self.user.id]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/api/organizations/%s/passwords/' % self.organization.id,
+                                    {'passwords': [self.passwords[0].id]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(self.organization.user_set.filter(id=self.user.id).exists())
+        self.assertFalse(self.organization.passwords.exists())
+
+    def test_requires_items(self):
+        response = self.client.post('/api/organizations/%s/passwords/' % self.organization.id, {}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/organizations/0/members/', {'emails': ['a@b.c']}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class ShareBulkTests(APITestCase):
+
+    def setUp(self):
+        audit.buffer.clear()
+        self.user = User.objects.create_user(email='bulk-sharer@example.com', password='x')
+        self.users = [User.objects.create_user(email='team%s@example.com' % i, password='x') for i in range(3)]
+        self.passwords = [Password.objects.create(title='team%s' % i, cipher_text=encrypt('weakpassword'),
+                                                  duration_in_days=30, expired_at=timezone.now(),
+                                                  created_by=self.user) for i in range(4)]
+        self.view = Permission.objects.get(codename='view_password')
+        self.change = Permission.objects.get(codename='change_password')
+        Share.objects.create(user=self.users[0], password=self.passwords[0]).permissions.add(self.view)
+        self.client.force_authenticate(self.user)
+
+    def body(self, **kwargs):
+        return dict({'users': [u.id for u in self.users], 'passwords': [p.id for p in self.passwords]}, **kwargs)
+
+    def test_share_dedupes(self):
+        with self.assertNumQueries(20):
+            response = self.client.post('/api/shares/bulk/', self.body(permissions=['view_password', 'change_password']),
+                                        format='json')
+        self.assertEqual((response.data['created'], response.data['permissions_added']), (11, 23))
+        self.assertEqual(Share.objects.count(), 12)
+        self.assertEqual(self.users[2].password_permissions(self.passwords[3].id),
+                         frozenset(['view_password', 'change_password']))
+
+        response = self.client.post('/api/shares/bulk/', self.body(permissions=['view_password']), format='json')
+        self.assertEqual((response.data['created'], response.data['permissions_added']), (0, 0))
+
+    def test_revoke(self):
+        self.client.post('/api/shares/bulk/', self.body(permissions=['view_password', 'change_password']),
+                         format='json')
+        response = self.client.post('/api/shares/bulk/revoke/', self.body(permissions=['change_password']),
+                                    format='json')
+        self.assertEqual(response.data['removed'], 12)
+        self.assertFalse(Share.objects.filter(permissions=self.change).exists())
+
+        cursor = ChangeLog.objects.order_by('-id').values_list('id', flat=True).first()
+        response = self.client.post('/api/shares/bulk/revoke/', self.body(users=[self.users[0].id]), format='json')
+        self.assertEqual(response.data['removed'], 4)
+        self.assertEqual(Share.objects.count(), 8)
+        # Lost access reaches /api/sync/
+        self.assertEqual(ChangeLog.objects.filter(id__gt=cursor, model='password', user=self.users[0]).count(), 4)
+
+    def test_only_owned_or_changeable_passwords(self):
+        outsider = self.users[1]
+        secret = Password.objects.create(title='not yours', cipher_text=encrypt('Secret#12345'), duration_in_days=30,
+                                         expired_at=timezone.now(), created_by=self.user)
+        self.client.force_authenticate(outsider)
+        response = self.client.post('/api/shares/bulk/', {'users': [outsider.id], 'passwords': [secret.id, 'x'],
+                                                          'permissions': ['view_password']}, format='json')
+        self.assertEqual((response.data['passwords'], response.data['not_found']), ([], [secret.id, 'x']))
+        self.assertFalse(Share.objects.filter(password=secret).exists())
+        self.assertNotIn(secret.id, [row['id'] for row in self.client.get('/api/passwords/').data['results']])
+
+        # A user shared change_password may pass the password on
+        Share.objects.create(user=outsider, password=secret).permissions.add(self.view, self.change)
+        response = self.client.post('/api/shares/bulk/', {'users': [self.users[2].id], 'passwords': [secret.id]},
+                                    format='json')
+        self.assertEqual((response.data['passwords'], response.data['created']), ([secret.id], 1))
+        response = self.client.post('/api/shares/bulk/revoke/', {'users': [self.users[2].id],
+                                                                 'passwords': [self.passwords[0].id]}, format='json')
+        self.assertEqual((response.data['not_found'], response.data['removed']), ([self.passwords[0].id], 0))
+
+    def test_validation(self):
+        response = self.client.post('/api/shares/bulk/', self.body(permissions=['fly']), format='json')
+        self.assertEqual(response.status_code, 400)
+        for permissions in ([{'x': 1}], [['view_password']]):
+            response = self.client.post('/api/shares/bulk/', self.body(permissions=permissions), format='json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/shares/bulk/', {'users': [self.user.id]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        with override_settings(BULK_SHARE_LIMIT=5):
+            response = self.client.post('/api/shares/bulk/', self.body(), format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class PasswordAccessTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(email='access-owner@example.com', password='x')
+        self.user = User.objects.create_user(email='access@example.com', password='x')
+        self.organization = Organization.objects.create(name='org', organizationId='access')
+        self.password = Password.objects.create(title='access', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                                created_by=self.owner)
+        self.view = Permission.objects.get(codename='view_password')
+
+    def mask(self, user=None):
+        return PasswordAccess.objects.filter(user=user or self.user, password=self.password).values_list(
+            'mask', flat=True).first()
+
+    def assertInSync(self):
+        self.assertEqual(access.rebuild(dry_run=True), (0, 0, 0))
+
+    def test_organization_changes(self):
+        self.assertEqual(self.mask(self.owner), PasswordAccess.OWNER)
+        self.organization.passwords.add(self.password)
+        self.user.organizations.add(self.organization)
+        self.assertEqual(self.mask(), PasswordAccess.ORGANIZATION)
+        self.assertEqual(self.mask(self.owner), PasswordAccess.OWNER)
+
+        self.organization.user_set.clear()
+        self.assertIsNone(self.mask())
+        self.organization.user_set.add(self.user, self.owner)
+        self.assertEqual(self.mask(self.owner), PasswordAccess.OWNER | PasswordAccess.ORGANIZATION)
+        self.password.organization_passwords.clear()
+        self.assertIsNone(self.mask())
+        self.organization.passwords.add(self.password)
+        self.organization.delete()
+        self.assertIsNone(self.mask())
+        self.assertInSync()
+
+    def test_share_changes(self):
+        share = Share.objects.create(user=self.user, password=self.password)
+        self.assertEqual(self.mask(), PasswordAccess.SHARED)
+        share.permissions.add(self.view)
+        self.assertEqual(self.user.password_permissions(self.password.id), frozenset(['view_password']))
+        self.view.share_permissions.clear()
+        self.assertEqual(self.mask(), PasswordAccess.SHARED)
+        share.delete()
+        self.assertIsNone(self.mask())
+        self.assertInSync()
+
+    def test_share_moved_to_another_pair(self):
+        share = Share.objects.create(user=self.user, password=self.password)
+        share.permissions.add(self.view)
+        other = Password.objects.create(title='other', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                        created_by=self.owner)
+        share.password = other
+        share.save()
+        self.assertIsNone(self.mask())
+        self.assertEqual(list(Password.objects.visible_to(self.user)), [other])
+        share.user = self.owner
+        share.save()
+        self.assertFalse(Password.objects.visible_to(self.user).exists())
+        self.assertInSync()
+
+    def test_owner_and_deletes(self):
+        Share.objects.create(user=self.owner, password=self.password)
+        self.password.created_by = self.user
+        self.password.save()
+        self.assertEqual(self.mask(), PasswordAccess.OWNER)
+        self.assertEqual(self.mask(self.owner), PasswordAccess.SHARED)
+        self.owner.delete()
+        self.assertInSync()
+        self.password.delete()
+        self.assertFalse(PasswordAccess.objects.exists())
+
+    def test_rebuild_command(self):
+        PasswordAccess.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_password_access', '--check', stdout=StringIO())
+        call_command('rebuild_password_access', stdout=StringIO())
+        call_command('rebuild_password_access', '--check', stdout=StringIO())
+        self.assertEqual(self.mask(self.owner), PasswordAccess.OWNER)
+
+
+class ReusedPasswordTests(APITestCase):
+
+    def setUp(self):
+        audit.buffer.clear()
+        self.user = User.objects.create_user(email='reuse@example.com', password='x')
+        self.client.force_authenticate(self.user)
+        for title, secret in (('a', 'Secret#0rd'), ('b', 'Other#0rd1'), ('c', 'Secret#0rd'), ('d', 'Secret#0rd')):
+            self.client.post('/api/passwords/', {'title': title, 'password': secret, 'duration_in_days': 30})
+        self.ids = dict(Password.objects.values_list('title', 'id'))
+
+    def test_reused(self):
+        with mock.patch('core.util.decrypt') as patched, self.assertNumQueries(2):
+            response = self.client.get('/api/passwords/reused/')
+        patched.assert_not_called()
+        self.assertEqual(response.data['results'], [{'count': 3, 'passwords': [
+            {'id': self.ids[title], 'title': title} for title in 'acd']}])
+
+        self.client.patch('/api/passwords/%s/' % self.ids['c'], {'password': 'Other#0rd1'})
+        response = self.client.get('/api/passwords/reused/')
+        self.assertEqual([group['count'] for group in response.data['results']], [2, 2])
+
+    def test_organization_reused(self):
+        organization = Organization.objects.create(name='org', organizationId='reuse')
+        organization.passwords.add(self.ids['a'], self.ids['b'])
+        response = self.client.get('/api/organizations/%s/reused/' % organization.id)
+        self.assertEqual(response.status_code, 404)
+        self.user.organizations.add(organization)
+        response = self.client.get('/api/organizations/%s/reused/' % organization.id)
+        self.assertEqual(response.data['results'], [])
+        organization.passwords.add(self.ids['d'])
+        response = self.client.get('/api/organizations/%s/reused/' % organization.id)
+        self.assertEqual(response.data['results'][0]['count'], 2)
+
+    def test_fingerprint_key(self):
+        derived = fingerprint('Secret#0rd')
+        with override_settings(ENCRYPT_KEY=Fernet.generate_key().decode()):
+            self.assertNotEqual(fingerprint('Secret#0rd'), derived)
+        with override_settings(FINGERPRINT_KEY='configured'):
+            self.assertEqual(fingerprint('Secret#0rd'),
+                             hmac.new(b'configured', b'Secret#0rd', hashlib.sha256).hexdigest())
+
+    def test_backfill(self):
+        Password.objects.update(fingerprint=None)
+        call_command('backfill_password_fingerprint', batch_size=3, stdout=StringIO())
+        self.assertEqual(Password.objects.filter(fingerprint=fingerprint('Secret#0rd')).count(), 3)
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='finder@example.com', password='x', first_name='Ada')
+        other = User.objects.create_user(email='hidden@example.com', password='x', first_name='Grace')
+        for title, owner in (('GitHub deploy key', self.user), ('gitlab', self.user), ('Mail server', self.user),
+                             ('github backup', other)):
+            Password.objects.create(title=title, cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                    created_by=owner)
+        Organization.objects.create(name='Platform team', organizationId='search1')
+        Organization.objects.create(name='Payments', organizationId='search2')
+        self.client.force_authenticate(self.user)
+
+    def titles(self, term):
+        return sorted(row['title'] for row in self.client.get('/api/passwords/', {'search': term}).data['results'])
+
+    def test_password_search_is_scoped_and_in_sync(self):
+        self.assertEqual(self.titles('hub'), ['GitHub deploy key'])
+        self.assertEqual(self.titles('GIT'), ['GitHub deploy key', 'gitlab'])
+        self.assertEqual(self.titles('gi'), ['GitHub deploy key', 'gitlab'])
+        self.assertEqual(self.titles('nothing'), [])
+
+        password = Password.objects.get(title='Mail server')
+        password.title = 'Mailhub'
+        password.save()
+        self.assertEqual(self.titles('hub'), ['GitHub deploy key', 'Mailhub'])
+        Password.objects.filter(title='gitlab').delete()
+        self.assertEqual(self.titles('git'), ['GitHub deploy key'])
+
+    def test_search_uses_the_index(self):
+        if connection.vendor != 'sqlite':
+            return
+        plan = search.search(Password.objects.all(), 'password', 'deploy').explain()
+        self.assertIn('core_password_search VIRTUAL TABLE INDEX', plan)
+
+    def test_organization_and_user_search_paginated(self):
+        response = self.client.get('/api/organizations/', {'search': 'pay', 'page_size': 1})
+        self.assertEqual([row['name'] for row in response.data['results']], ['Payments'])
+        self.assertIsNone(response.data['next'])
+        response = self.client.get('/api/organizations/', {'search': 'pla'})
+        self.assertEqual([row['name'] for row in response.data['results']], ['Platform team'])
+        # Without a term the listing is unpaginated as before
+        self.assertEqual(len(self.client.get('/api/organizations/').data), 2)
+
+        response = self.client.get('/api/users/', {'search': 'grace'})
+        self.assertEqual([row['email'] for row in response.data['results']], ['hidden@example.com'])
+        response = self.client.get('/api/users/', {'search': 'example', 'page_size': 1})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+
+
+class AuditTests(APITestCase):
+
+    def setUp(self):
+        audit.buffer.clear()
+        self.admin = User.objects.create_user(email='auditor@example.com', password='x', is_staff=True)
+        self.user = User.objects.create_user(email='revealer@example.com', password='x')
+        self.password = Password.objects.create(title='audited', cipher_text=encrypt('weakpassword'),
+                                                duration_in_days=30, created_by=self.admin,
+                                                expired_at=timezone.now() + timedelta(days=30))
+        self.client.force_authenticate(self.admin)
+
+    def test_reveal_is_buffered_until_flush(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/passwords/%s/' % self.password.id)
+        self.assertFalse(AuditEvent.objects.exists())
+        self.assertEqual(audit.buffer.flush(), 1)
+        event = AuditEvent.objects.get()
+        self.assertEqual((event.action, event.user_id, event.password_id), ('reveal', self.admin.id, self.password.id))
+        self.assertEqual(event.remote_addr, '127.0.0.1')
+
+    @override_settings(AUDIT_BATCH_SIZE=3, AUDIT_MAX_BUFFER=4)
+    def test_full_batch_is_written_and_overflow_dropped(self):
+        for _ in range(2):
+            audit.record('reveal', self.admin, self.password.id)
+        self.assertFalse(AuditEvent.objects.exists())
+        audit.record('reveal', self.admin, self.password.id)
+        self.assertEqual(AuditEvent.objects.count(), 3)
+
+        dropped = audit.buffer.stats()['dropped']
+        with mock.patch.object(audit.buffer, 'flush'):
+            for _ in range(6):
+                audit.record('reveal', self.admin, self.password.id)
+        self.assertEqual(audit.buffer.stats()['buffered'], 4)
+        self.assertEqual(audit.buffer.stats()['dropped'], dropped + 2)
+
+    def test_share_changes_and_shared_access(self):
+        view = Permission.objects.get(codename='view_password')
+        response = self.client.post('/api/shares/', {'user': self.user.id, 'password': self.password.id,
+                                                     'permissions': [view.id]})
+        share_id = response.data['id']
+        self.client.force_authenticate(self.user)
+        self.client.get('/api/shared_passwords/%s/' % self.password.id)
+        self.client.force_authenticate(self.admin)
+        self.client.delete('/api/shares/%s/' % share_id)
+        audit.buffer.flush()
+
+        events = list(AuditEvent.objects.order_by('id').values_list('action', 'user_id', 'share_id', 'detail'))
+        self.assertEqual(events, [
+            ('share_create', self.admin.id, share_id, 'view_password'),
+            ('shared_access', self.user.id, None, 'GET'),
+            ('reveal', self.user.id, None, ''),
+            ('share_delete', self.admin.id, share_id, ''),
+        ])
+
+    def test_bulk_shares_audit_only_changes(self):
+        other = Password.objects.create(title='other', cipher_text=encrypt('weakpassword'), duration_in_days=30,
+                                        created_by=self.admin, expired_at=timezone.now() + timedelta(days=30))
+        Share.objects.create(user=self.user, password=self.password).permissions.add(
+            Permission.objects.get(codename='view_password'))
+        body = {'users': [self.user.id, self.admin.id], 'passwords': [self.password.id, other.id],
+                'permissions': ['view_password']}
+        self.client.post('/api/shares/bulk/', body, format='json')
+        self.client.post('/api/shares/bulk/', body, format='json')
+        self.client.post('/api/shares/bulk/revoke/', dict(body, users=[self.user.id], passwords=[other.id]),
+                         format='json')
+        self.client.post('/api/shares/bulk/revoke/', dict(body, users=[self.user.id], passwords=[other.id]),
+                         format='json')
+        audit.buffer.flush()
+
+        events = AuditEvent.objects.values_list('action', 'target_user_id', 'password_id')
+        self.assertEqual(sorted(events), sorted([
+            ('share_grant', self.user.id, other.id),
+            ('share_grant', self.admin.id, self.password.id),
+            ('share_grant', self.admin.id, other.id),
+            ('share_revoke', self.user.id, other.id),
+        ]))
+
+    def test_query_api(self):
+        audit.record('reveal', self.admin, self.password.id)
+        audit.record('reveal', self.user, self.password.id)
+        audit.record('reveal', self.user, 0)
+        audit.buffer.flush()
+
+        response = self.client.get('/api/audit/', {'user': self.user.id, 'password': self.password.id})
+        self.assertEqual([row['user_id'] for row in response.data['results']], [self.user.id])
+        response = self.client.get('/api/audit/', {'since': (timezone.now() + timedelta(minutes=1)).isoformat()})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get('/api/audit/', {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        self.assertEqual(self.client.get('/api/audit/', {'until': 'yesterday'}).status_code, 400)
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/audit/').status_code, 403)
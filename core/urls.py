@@ -5,24 +5,35 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
+from . import async_views
 from .views import (PasswordViewSet, OrganizationViewSet, registration,
                     OrganizationJoinMemberAPIView, OrganizationAddPasswordsAPIView,
                     ShareViewSet, get_permissions,
-                    SharedPasswordView, UserViewSet, authUser)
+                    SharedPasswordView, UserViewSet, authUser, metrics,
+                    TokenRevokeView, health, SyncView, AuditEventViewSet)
 
 router = routers.SimpleRouter()
 router.register(r'passwords', PasswordViewSet)
 router.register(r'organizations', OrganizationViewSet)
 router.register(r'shares', ShareViewSet)
 router.register(r'users', UserViewSet)
+router.register(r'audit', AuditEventViewSet)
 
 urlpatterns = [
     path('register/', registration, name='user_registration'),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/revoke/', TokenRevokeView.as_view(), name='token_revoke'),
     path('organizations/<int:organization_id>/join-as-member/', OrganizationJoinMemberAPIView.as_view(), name='join_as_staff'),
     path('organizations/<int:organization_id>/add-passwords/', OrganizationAddPasswordsAPIView.as_view(), name='add_passwords'),
     path('permissions/', get_permissions),
     path('shared_passwords/<int:password_id>/', SharedPasswordView.as_view(), name='shared_passwords'),
     path('users/me/', authUser, name='auth_user'),
+    path('metrics/', metrics, name='metrics'),
+    path('health/', health, name='health'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('async/passwords/', async_views.password_list, name='async_passwords'),
+    path('async/passwords/<int:password_id>/', async_views.password_detail, name='async_password_detail'),
+    path('async/shared_passwords/<int:password_id>/', async_views.shared_password_detail,
+         name='async_shared_passwords'),
 ]+ router.urls
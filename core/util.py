@@ -1,27 +1,159 @@
-from cryptography.fernet import Fernet
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
+import hmac
+import re
 import logging
 import traceback
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
+from .ciphers import BACKENDS
+from .instrumentation import timed
+
+
+def get_cipher(backend=None):
+    """
+    Return the process wide cipher backend, settings.ENCRYPT_BACKEND unless
+    named. It encrypts with settings.ENCRYPT_KEY and decrypts with it or
+    any of settings.ENCRYPT_OLD_KEYS.
+    """
+    return _load_cipher(backend or settings.ENCRYPT_BACKEND)
+
+
+@lru_cache(maxsize=None)
+def _load_cipher(name):
+    keys = [settings.ENCRYPT_KEY] + list(settings.ENCRYPT_OLD_KEYS)
+    return BACKENDS[name](keys)
+
+
+def cipher_for(value):
+    """
+    The backend whose format a stored value is in.
+    """
+    for name, backend in BACKENDS.items():
+        if backend.handles(value):
+            return get_cipher(name)
+    raise ValueError('Unknown cipher text format')
+
+
+@lru_cache(maxsize=None)
+def get_executor(workers):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crypto')
+
+
+@receiver(setting_changed)
+def reset_cipher(**kwargs):
+    if kwargs['setting'] in ('ENCRYPT_KEY', 'ENCRYPT_OLD_KEYS', 'ENCRYPT_BACKEND'):
+        _load_cipher.cache_clear()
+
+
+@timed('crypto')
 def encrypt(pas):
-    try:        
-        pas = str(pas)
-        cipher_pass = Fernet(settings.ENCRYPT_KEY)
-        encrypt_pass = cipher_pass.encrypt(pas.encode('ascii'))
-        encrypt_pass = base64.urlsafe_b64encode(encrypt_pass).decode("ascii") 
-        return encrypt_pass
+    """
+    Encrypt with the configured backend: text for fernet, bytes for aesgcm.
+    """
+    try:
+        return get_cipher().encrypt(str(pas).encode('utf-8'))
     except Exception as e:
         logging.getLogger("error_logger").error(traceback.format_exc())
         return None
 
 
+@timed('crypto')
 def decrypt(pas):
     try:
-        pas = base64.urlsafe_b64decode(pas)
-        cipher_pass = Fernet(settings.ENCRYPT_KEY)
-        decod_pass = cipher_pass.decrypt(pas).decode("ascii")     
-        return decod_pass
+        return cipher_for(pas).decrypt(pas).decode('utf-8')
+    except Exception as e:
+        logging.getLogger("error_logger").error(traceback.format_exc())
+        return None
+
+
+@timed('crypto')
+def rotate(pas):
+    """
+    Re-encrypt a stored value with the primary key and the configured
+    backend. Values that already use both are returned unchanged.
+    """
+    try:
+        cipher, source = get_cipher(), cipher_for(pas)
+        if source is cipher and cipher.is_current(pas):
+            return pas
+        return cipher.encrypt(source.decrypt(pas))
     except Exception as e:
         logging.getLogger("error_logger").error(traceback.format_exc())
-        return None
\ No newline at end of file
+        return None
+
+
+def upgrade(pas):
+    """
+    Re-encrypt a value stored in another backend's format with the
+    configured one, used to migrate legacy rows when they are written.
+    """
+    if pas and cipher_for(pas) is not get_cipher():
+        return rotate(pas)
+    return pas
+
+
+@lru_cache(maxsize=None)
+def _fingerprint_key(fingerprint_key, encrypt_key):
+    if fingerprint_key:
+        return fingerprint_key.encode()
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                info=b'core.util.fingerprint').derive(base64.urlsafe_b64decode(encrypt_key))
+
+
+def fingerprint(pas):
+    """
+    HMAC-SHA256 of a plaintext password under settings.FINGERPRINT_KEY, or
+    a key derived from settings.ENCRYPT_KEY, to find reused secrets without
+    decrypting them.
+    """
+    if pas is None:
+        return None
+    key = _fingerprint_key(settings.FINGERPRINT_KEY, settings.ENCRYPT_KEY)
+    return hmac.new(key, str(pas).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def password_strength(pas):
+    """
+    Classify a plaintext password as Strong or Weak, None if it matches neither.
+    """
+    if pas is None:
+        return None
+    if(bool(re.match('((?=.*\d)(?=.*[a-z])(?=.*[A-Z])(?=.*[!@#$%^&*]).{8,30})',pas))==True):
+        return "Strong"
+    elif(bool(re.match('((\d*)([a-z]*)([A-Z]*)([!@#$%^&*]*).{8,30})',pas))==True):
+        return "Weak"
+
+
+@timed('crypto')
+def _map_batch(func, values, workers=None):
+    """
+    Apply func to every value, splitting large batches across a thread pool.
+    cryptography releases the GIL inside its primitives so threads scale.
+    Order is preserved and a failing item yields None like func itself.
+    """
+    values = list(values)
+    workers = workers or settings.CRYPTO_WORKERS
+    if workers <= 1 or len(values) < settings.CRYPTO_BATCH_THRESHOLD:
+        return [func(value) for value in values]
+
+    size = -(-len(values) // workers)
+    chunks = [values[i:i + size] for i in range(0, len(values), size)]
+    results = []
+    for chunk in get_executor(workers).map(lambda chunk: [func(value) for value in chunk], chunks):
+        results.extend(chunk)
+    return results
+
+
+def encrypt_many(values, workers=None):
+    return _map_batch(encrypt, values, workers)
+
+
+def decrypt_many(values, workers=None):
+    return _map_batch(decrypt, values, workers)
@@ -1,23 +1,43 @@
-from django.shortcuts import render
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
+import re
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.shortcuts import render, get_object_or_404
+from rest_framework.decorators import action, api_view, permission_classes, authentication_classes
 from rest_framework.authentication import SessionAuthentication
-from rest_framework.permissions import  AllowAny, IsAuthenticated
-from rest_framework.exceptions import APIException
+from rest_framework.permissions import  AllowAny, IsAuthenticated, IsAdminUser
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth.models import Permission
-from django.db.models import Q
 
-from core.models import Password, Organization, User, Share
+from core.models import Password, Organization, User, Share, AuditEvent
 from .serializers import (RegisterSerializer, PasswordSerializer, 
                           OrganizationSerializer, ShareSerializer,
-                          PermissionSerializer)
-from django.http import JsonResponse
+                          PermissionSerializer, AuditEventSerializer)
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.db import connection, DatabaseError
+from django.db.models import Count, Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.db.models.functions import Concat
 from django.db.models import Value as V
 from rest_framework.generics import RetrieveUpdateDestroyAPIView
-from .permissions import ShareModelPermissions
+from .permissions import ShareModelPermissions, IsInternalOrAdmin
+from .instrumentation import registry
+from .caching import CachedLookup
+from .conditional import ConditionalMixin
+from . import audit, sync
+from .authentication import revoke_token
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
+from .pagination import PasswordCursorPagination, SearchCursorPagination, AuditCursorPagination
+from .search import IndexedSearchFilter
+from .bulk import (import_passwords, read_rows, export_rows, stream_csv, stream_ndjson,
+                   add_members, add_passwords, share_many, revoke_many)
 class CsrfExemptSessionAuthentication(SessionAuthentication):
     def enforce_csrf(self, request):
         return  # To not perform the csrf check previously happening
@@ -39,19 +59,144 @@ def registration(request):
         serializer.save()
         return Response({'detail':'Registration success.'}, status.HTTP_201_CREATED)
 
-class PasswordViewSet(viewsets.ModelViewSet):
+class PasswordViewSet(ConditionalMixin, viewsets.ModelViewSet):
     queryset = Password.objects.all()
     serializer_class = PasswordSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = PasswordCursorPagination
+    filter_backends = [IndexedSearchFilter]
+    search_index = 'password'
     
+    # Shared passwords are changed or deleted only with that permission in the share
+    action_permissions = {
+        'update': 'change_password',
+        'partial_update': 'change_password',
+        'destroy': 'delete_password',
+    }
+
     def get_queryset(self):
-        return super().get_queryset().filter(Q(id__in=self.request.user.passwords) | Q(created_by=self.request.user))
+        permission = self.action_permissions.get(self.action, 'view_password')
+        queryset = super().get_queryset().visible_to(self.request.user, permission).with_status()
+        strength = self.request.query_params.get('strength')
+        if strength:
+            queryset = queryset.filter(strength=strength)
+        return queryset
+
+    def collection_aggregates(self):
+        # Status flips with time, not with updated_at
+        return dict(super().collection_aggregates(), expired=Count('id', filter=Q(expired_at__lte=timezone.now())))
+
+    def resource_etag_parts(self, instance):
+        return super().resource_etag_parts(instance) + (instance.expiry_status,)
+
+    @action(detail=False, methods=['get'], url_path='expiring')
+    def expiring(self, request):
+        """ Passwords expiring within ?within= (e.g. 7d, 12h, default 7d) """
+        within = parse_duration(request.query_params.get('within', '7d'))
+        if within is None:
+            return Response({'message':'within must look like 7d, 12h or 30m and be at most %s days'
+                             % MAX_EXPIRING_WITHIN.days}, status.HTTP_400_BAD_REQUEST)
+        self.cursor_ordering = 'expired_at'
+        queryset = self.get_queryset().expiring_within(within)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], url_path='reused')
+    def reused(self, request):
+        """ Visible passwords that share their secret with another one """
+        return Response({'results': reuse_groups(self.get_queryset())}, status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """ Import passwords from an uploaded CSV or NDJSON file """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'message':'file is required'}, status.HTTP_400_BAD_REQUEST)
+        created, errors = import_passwords(read_rows(upload), request.user)
+        return Response({'created': created, 'errors': errors},
+                        status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def bulk_export(self, request):
+        """ Stream visible passwords as NDJSON (default) or CSV """
+        include_secret = request.query_params.get('include_secret', '').lower() in ('true', '1', 'yes')
+        rows = export_rows(self.get_queryset(), include_secret=include_secret, request=request)
+        if request.query_params.get('output') == 'csv':
+            response = StreamingHttpResponse(stream_csv(rows), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="passwords.csv"'
+        else:
+            response = StreamingHttpResponse(stream_ndjson(rows), content_type='application/x-ndjson')
+            response['Content-Disposition'] = 'attachment; filename="passwords.ndjson"'
+        return response
+
+
+# Longest ?within= accepted by /api/passwords/expiring/
+MAX_EXPIRING_WITHIN = timedelta(days=3650)
+
+
+def parse_duration(value, maximum=MAX_EXPIRING_WITHIN):
+    """ Parse '7d', '12h', '30m' or a plain number of days into a timedelta, None if invalid or over maximum """
+    match = re.fullmatch(r'(\d+)([dhm]?)', value.strip())
+    if match is None:
+        return None
+    unit = {'': 'days', 'd': 'days', 'h': 'hours', 'm': 'minutes'}[match.group(2)]
+    try:
+        duration = timedelta(**{unit: int(match.group(1))})
+    except OverflowError:
+        return None
+    return duration if duration <= maximum else None
 
 
-class OrganizationViewSet(viewsets.ModelViewSet):
-    queryset = Organization.objects.all()
+def reuse_groups(queryset):
+    """
+    Passwords of the queryset grouped by fingerprint, largest group first.
+    One GROUP BY on the fingerprint index and one query for the members.
+    """
+    groups = list(queryset.reused())
+    members = defaultdict(list)
+    for fingerprint, password_id, title in queryset.filter(
+            fingerprint__in=[group['fingerprint'] for group in groups]
+    ).order_by('id').values_list('fingerprint', 'id', 'title'):
+        members[fingerprint].append({'id': password_id, 'title': title})
+    return [{'count': group['count'], 'passwords': members[group['fingerprint']]} for group in groups]
+
+
+class OrganizationViewSet(ConditionalMixin, viewsets.ModelViewSet):
+    queryset = Organization.objects.prefetch_related(
+        Prefetch('user_set', queryset=User.objects.only('id')),
+        Prefetch('passwords', queryset=Password.objects.only('id')),
+    )
     serializer_class = OrganizationSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = SearchCursorPagination
+    filter_backends = [IndexedSearchFilter]
+    search_index = 'organization'
+
+    @action(detail=True, methods=['post'], url_path='members')
+    def bulk_members(self, request, pk=None):
+        """ Add members by {"emails": [...], "user_ids": [...]}, members only """
+        emails, user_ids = request.data.get('emails', []), request.data.get('user_ids', [])
+        if not isinstance(emails, list) or not isinstance(user_ids, list) or not (emails or user_ids):
+            return Response({'message':'emails or user_ids is required'}, status.HTTP_400_BAD_REQUEST)
+        organization = get_object_or_404(request.user.organizations.all(), id=pk)
+        return Response({'results': add_members(organization, emails, user_ids)}, status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'], url_path='passwords')
+    def bulk_passwords(self, request, pk=None):
+        """ Add passwords by {"passwords": [...]}, members only and only passwords the caller may change """
+        password_ids = request.data.get('passwords')
+        if not isinstance(password_ids, list) or not password_ids:
+            return Response({'message':'passwords is required'}, status.HTTP_400_BAD_REQUEST)
+        organization = get_object_or_404(request.user.organizations.all(), id=pk)
+        return Response({'results': add_passwords(organization, password_ids, request.user)}, status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='reused')
+    def reused(self, request, pk=None):
+        """ Passwords of the organization that share their secret with another one, members only """
+        organization = get_object_or_404(request.user.organizations.all(), id=pk)
+        return Response({'results': reuse_groups(Password.objects.filter(organization_passwords=organization))},
+                        status.HTTP_200_OK)
     
 class OrganizationJoinMemberAPIView(APIView):
     permission_classes = [IsAuthenticated]
@@ -65,7 +210,6 @@ class OrganizationJoinMemberAPIView(APIView):
             try:
                 organization = Organization.objects.get(id=organization_id)
                 user.organizations.add(organization)
-                user.save()
             except:
                 # No Organization found
                 return Response({'error': 'No Organization found.'}, status.HTTP_404_NOT_FOUND)
@@ -85,7 +229,6 @@ class OrganizationAddPasswordsAPIView(APIView):
             try:
                 organization = Organization.objects.get(id=organization_id)
                 organization.passwords.add(*passwords)
-                organization.save()
             except:
                 # No Organization found
                 return Response({'error': 'No Organization found.'}, status.HTTP_404_NOT_FOUND)
@@ -94,17 +237,95 @@ class OrganizationAddPasswordsAPIView(APIView):
         return Response({'message':'Successfully added passwords.'}, status.HTTP_200_OK)
 
 class ShareViewSet(viewsets.ModelViewSet):
-    queryset = Share.objects.all()
+    queryset = Share.objects.prefetch_related(
+        Prefetch('permissions', queryset=Permission.objects.only('id')),
+    )
     serializer_class = ShareSerializer
     permission_classes = (IsAuthenticated,)
 
+    def audit_share(self, action, share, permissions=()):
+        audit.record(action, self.request.user, password_id=share.password_id, share_id=share.id,
+                     target_user_id=share.user_id, detail=','.join(p.codename for p in permissions),
+                     request=self.request)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.audit_share('share_create', serializer.instance, serializer.validated_data.get('permissions', ()))
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.audit_share('share_update', serializer.instance, serializer.validated_data.get('permissions', ()))
+
+    def perform_destroy(self, instance):
+        self.audit_share('share_delete', instance)
+        super().perform_destroy(instance)
+
+    def bulk_arguments(self, request):
+        """
+        Resolve {"users": [...], "passwords": [...], "permissions": [codenames]}
+        to existing ids. Only passwords the caller owns or may change can be
+        shared or revoked, other ids are reported as not found. Returns
+        (users, passwords, permissions, not_found, error response).
+        """
+        data = {key: request.data.get(key) for key in ('users', 'passwords', 'permissions')}
+        if not all(isinstance(data[key], list) and data[key] for key in ('users', 'passwords')) or \
+                not isinstance(data['permissions'] or [], list):
+            return None, None, None, None, Response({'message':'users and passwords are required lists'},
+                                                    status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(codename, str) for codename in data['permissions'] or []):
+            return None, None, None, None, Response({'message':'permissions must be a list of codenames'},
+                                                    status.HTTP_400_BAD_REQUEST)
+        if len(data['users']) * len(data['passwords']) > settings.BULK_SHARE_LIMIT:
+            return None, None, None, None, Response(
+                {'message':'At most %s shares per request' % settings.BULK_SHARE_LIMIT}, status.HTTP_400_BAD_REQUEST)
+        users = list(User.objects.filter(id__in=[i for i in data['users'] if str(i).isdigit()])
+                     .order_by('id').values_list('id', flat=True))
+        passwords = list(Password.objects.changeable_by(request.user)
+                         .filter(id__in=[i for i in data['passwords'] if str(i).isdigit()])
+                         .order_by('id').values_list('id', flat=True))
+        found_ids = set(passwords)
+        not_found = [i for i in data['passwords'] if not str(i).isdigit() or int(i) not in found_ids]
+        permissions = None
+        if data['permissions']:
+            found = dict(permissions_list_queryset().filter(codename__in=data['permissions'])
+                         .values_list('codename', 'id'))
+            unknown = sorted(set(data['permissions']) - set(found))
+            if unknown:
+                return None, None, None, None, Response(
+                    {'message':'Unknown permissions: %s' % ', '.join(map(str, unknown))}, status.HTTP_400_BAD_REQUEST)
+            permissions = sorted(found.values())
+        return users, passwords, permissions, not_found, None
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_share(self, request):
+        """ Share every password with every user """
+        users, passwords, permissions, not_found, error = self.bulk_arguments(request)
+        if error:
+            return error
+        created, granted = share_many(users, passwords, permissions or [], request=request)
+        return Response({'users': users, 'passwords': passwords, 'not_found': not_found, 'created': created,
+                         'permissions_added': granted}, status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='bulk/revoke')
+    def bulk_revoke(self, request):
+        """ Remove the permissions, or the shares when no permissions are given """
+        users, passwords, permissions, not_found, error = self.bulk_arguments(request)
+        if error:
+            return error
+        removed = revoke_many(users, passwords, permissions, request=request)
+        return Response({'users': users, 'passwords': passwords, 'not_found': not_found, 'removed': removed},
+                        status.HTTP_200_OK)
+
 # Get all permissions
 @api_view(['GET'])
 @permission_classes((IsAuthenticated, ))
 def get_permissions(request):
-    permission_list = permissions_list_queryset()
-    serializer = PermissionSerializer(permission_list, many=True) 
-    return JsonResponse(serializer.data, safe=False)
+    payload, etag = permission_catalogue.get()
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(payload, content_type='application/json')
+    response['ETag'] = etag
+    return response
 
 def permissions_list_queryset():
     model_name = [
@@ -116,17 +337,29 @@ def permissions_list_queryset():
         
     return permission_list
 
+# Only changes when migrations run, see core.caching
+permission_catalogue = CachedLookup(
+    'permissions', lambda: PermissionSerializer(permissions_list_queryset(), many=True).data)
+
 class SharedPasswordView(RetrieveUpdateDestroyAPIView):
     serializer_class = PasswordSerializer
     lookup_url_kwarg = 'password_id'
     queryset = Password.objects.all()
     permission_classes = (IsAuthenticated, ShareModelPermissions)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        audit.record('shared_access', request.user, password_id=kwargs.get('password_id'), detail=request.method,
+                     request=request)
     
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """ User Listing """
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = SearchCursorPagination
+    filter_backends = [IndexedSearchFilter]
+    search_index = 'user'
 
     def get_queryset(self, *args, **kwargs):
         return User.objects.filter(is_superuser=False)
@@ -139,3 +372,84 @@ def authUser(request):
         user = request.user
         userserializer = RegisterSerializer(user)
         return JsonResponse(userserializer.data, status=status.HTTP_200_OK)
+
+
+class TokenRevokeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """ Revoke the access token of this request and optionally a refresh token """
+        if request.auth is not None:
+            revoke_token(request.auth)
+        if request.data.get('refresh'):
+            try:
+                revoke_token(RefreshToken(request.data['refresh']))
+            except TokenError:
+                return Response({'message':'Invalid refresh token.'}, status.HTTP_400_BAD_REQUEST)
+        return Response({'message':'Token revoked.'}, status.HTTP_200_OK)
+
+
+class SyncView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """ Changes after ?since=<cursor>, at most ?limit= (500) change log entries """
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = min(int(request.query_params.get('limit', 500)), 1000)
+        except ValueError:
+            return Response({'message':'since and limit must be integers'}, status.HTTP_400_BAD_REQUEST)
+        if since < 0 or limit < 1:
+            return Response({'message':'since must not be negative and limit must be at least 1'},
+                            status.HTTP_400_BAD_REQUEST)
+        cursor, has_more, upserts, deletes = sync.feed(request.user, since, limit, {'request': request})
+        return Response({'cursor': cursor, 'has_more': has_more, 'upserts': upserts, 'deletes': deletes})
+
+
+class AuditEventViewSet(viewsets.ReadOnlyModelViewSet):
+    """ Audit trail, filtered by ?user=, ?password=, ?since= and ?until= """
+    queryset = AuditEvent.objects.all()
+    serializer_class = AuditEventSerializer
+    permission_classes = (IsAdminUser,)
+    pagination_class = AuditCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        for param, field in (('user', 'user_id'), ('password', 'password_id')):
+            if param in params:
+                if not params[param].isdigit():
+                    raise ValidationError({'message': '%s must be an integer' % param})
+                queryset = queryset.filter(**{field: params[param]})
+        for param, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lt')):
+            if param in params:
+                try:
+                    value = parse_datetime(params[param])
+                except ValueError:
+                    value = None
+                if value is None:
+                    raise ValidationError({'message': '%s must be an ISO 8601 datetime' % param})
+                if timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+
+# Database health check for load balancers
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes((AllowAny, ))
+def health(request):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except DatabaseError:
+        return JsonResponse({'database': 'unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return JsonResponse({'database': 'ok', 'vendor': connection.vendor})
+
+
+# Instrumentation histograms
+@api_view(['GET'])
+@permission_classes((IsInternalOrAdmin, ))
+def metrics(request):
+    return JsonResponse(dict(registry.snapshot(), audit_buffer=audit.buffer.stats()))
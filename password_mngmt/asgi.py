@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'password_mngmt.settings')
 
 application = get_asgi_application()
+
+# Audit events are written by a background thread in each server process
+from core import audit  # noqa: E402
+audit.start()
@@ -10,9 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +56,9 @@ MIDDLEWARE = [
 ]
 
 
+# Trust the signed token claims instead of loading the user on every request
+JWT_STATELESS = config('JWT_STATELESS', default=False, cast=bool)
+
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
@@ -61,7 +66,8 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES' : (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.StatelessJWTAuthentication' if JWT_STATELESS
+        else 'core.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication'
     ),
 }
@@ -91,12 +97,41 @@ WSGI_APPLICATION = 'password_mngmt.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql for production, sqlite runs in WAL mode (see core/db.py)
+DB_ENGINE = config('DB_ENGINE', default='sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='password_mngmt'),
+            'USER': config('DB_USER', default='postgres'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='127.0.0.1'),
+            'PORT': config('DB_PORT', default='5432'),
+            # Persistent connections, checked before reuse
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=600, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            # Required behind a transaction pooling PgBouncer
+            'DISABLE_SERVER_SIDE_CURSORS': config('DB_PGBOUNCER', default=False, cast=bool),
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=600, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before "database is locked"
+                'timeout': 20,
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -145,8 +180,46 @@ AUTH_USER_MODEL = 'core.User'
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
-    'SIGNING_KEY': config('JWT_SECRET')
+    'SIGNING_KEY': config('JWT_SECRET'),
+    'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'core.serializers.TokenRefreshSerializer',
 }
 
-ENCRYPT_KEY = b'tmzHcYuvLUhxjcxZ4k_iqfCx-HUq6PCvdbXr4vOC5B4='
+ENCRYPT_KEY = config('ENCRYPT_KEY', default='tmzHcYuvLUhxjcxZ4k_iqfCx-HUq6PCvdbXr4vOC5B4=')
+# Retired keys, still accepted for decryption until rotate_encrypt_key has run
+ENCRYPT_OLD_KEYS = config('ENCRYPT_OLD_KEYS', default='', cast=Csv())
+# HMAC key for Password.fingerprint. Unset, a separate key is derived from
+# ENCRYPT_KEY, so replacing ENCRYPT_KEY changes it too. Changing it requires
+# ./manage.py backfill_password_fingerprint --all
+FINGERPRINT_KEY = config('FINGERPRINT_KEY', default='')
+# Format of newly written secrets, see core.ciphers: aesgcm (binary) or fernet (legacy text)
+ENCRYPT_BACKEND = config('ENCRYPT_BACKEND', default='aesgcm')
+# Threads used by encrypt_many/decrypt_many, batches smaller than the threshold run inline
+CRYPTO_WORKERS = config('CRYPTO_WORKERS', default=os.cpu_count() or 1, cast=int)
+CRYPTO_BATCH_THRESHOLD = config('CRYPTO_BATCH_THRESHOLD', default=64, cast=int)
+# Threads decrypting for the async views in core/async_views.py
+ASYNC_CRYPTO_WORKERS = config('ASYNC_CRYPTO_WORKERS', default=os.cpu_count() or 1, cast=int)
 BASE_URL = config('BASE_URL')
+
+# Per-request timings in Server-Timing headers and histograms at /api/metrics/
+INSTRUMENTATION_ENABLED = config('INSTRUMENTATION_ENABLED', default=False, cast=bool)
+# Addresses allowed to read /api/metrics/ without a staff login, none by default since
+# behind a local reverse proxy every request comes from 127.0.0.1
+INTERNAL_IPS = config('INTERNAL_IPS', default='', cast=Csv())
+
+# Change log entries younger than this are held back from /api/sync/ so
+# that rows from transactions still in flight are not skipped
+SYNC_SETTLE_SECONDS = config('SYNC_SETTLE_SECONDS', default=2, cast=int)
+
+# Seconds a user's shared permissions on a password stay cached, 0 disables
+SHARE_PERMISSIONS_CACHE_TIMEOUT = config('SHARE_PERMISSIONS_CACHE_TIMEOUT', default=0, cast=int)
+
+# Largest users x passwords product accepted by /api/shares/bulk/
+BULK_SHARE_LIMIT = config('BULK_SHARE_LIMIT', default=20000, cast=int)
+
+# Audit events (core.audit) are buffered in memory and written in batches of
+# AUDIT_BATCH_SIZE, at least every AUDIT_FLUSH_INTERVAL seconds. Past
+# AUDIT_MAX_BUFFER waiting events new ones are dropped and counted in /api/metrics/
+AUDIT_BATCH_SIZE = config('AUDIT_BATCH_SIZE', default=500, cast=int)
+AUDIT_FLUSH_INTERVAL = config('AUDIT_FLUSH_INTERVAL', default=2.0, cast=float)
+AUDIT_MAX_BUFFER = config('AUDIT_MAX_BUFFER', default=50000, cast=int)
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'password_mngmt.settings')
 
 application = get_wsgi_application()
+
+# Audit events are written by a background thread in each server process
+from core import audit  # noqa: E402
+audit.start()